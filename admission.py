@@ -0,0 +1,254 @@
+import hashlib
+import multiprocessing
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class AdmissionError(Exception):
+    """Raised when a generation request is rejected before any work starts"""
+
+    def __init__(self, message, status=429, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+def progression_length(generator, progression_type):
+    """Count chords in a preset or custom progression without parsing it"""
+    if progression_type in generator.CHORD_PROGRESSIONS:
+        return len(generator.CHORD_PROGRESSIONS[progression_type])
+    return progression_type.count('-') + 1
+
+
+def melody_cost(generator, params):
+    """Estimate the number of note events a melody request will produce"""
+    pattern = generator.RHYTHM_PATTERNS.get(params['rhythm_pattern'], ())
+    return max(0, params['bars']) * len(pattern) * 2
+
+
+def chord_cost(generator, params):
+    """Estimate the number of note events a chord progression request will produce"""
+    length = progression_length(generator, params['progression_type'])
+    repetitions = max(1, params['total_bars'] // length)
+
+    # Size of the largest chord the selected extension level can produce
+    qualities = generator.CHORD_QUALITIES.get(generator.QUALITY_MAP.get(params['chord_type']), {})
+    chord_size = max((len(generator.CHORD_TYPES[q]) for q in qualities.values()), default=3)
+
+    cost = repetitions * length * chord_size * 2
+    # Strummed chords need per-note offsets on top of the events themselves
+    if params['strum_in'] != 'none' or params['strum_out'] != 'none':
+        cost += cost // 4
+    return cost
+
+
+class Ticket:
+    """Admission for one request; release it once the response is finished"""
+
+    def __init__(self, slots=None):
+        self._slots = slots
+        self._released = False
+
+    def release(self):
+        if not self._released and self._slots is not None:
+            self._slots.release()
+        self._released = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SharedSlots:
+    """Heavy request slots shared by processes forked after it was created
+
+    Each slot records the pid holding it, so the slots of a worker that was
+    killed mid-request are taken back instead of leaking.
+    """
+
+    def __init__(self, count, poll_interval=0.05):
+        self.poll_interval = poll_interval
+        self._owners = multiprocessing.RawArray('i', count)
+        self._lock = multiprocessing.Lock()
+
+    def _try_acquire(self):
+        pid = os.getpid()
+        with self._lock:
+            for slot, owner in enumerate(self._owners):
+                if owner == 0 or (owner != pid and not process_alive(owner)):
+                    self._owners[slot] = pid
+                    return True
+        return False
+
+    def acquire(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._try_acquire():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(self.poll_interval)
+        return True
+
+    def release(self):
+        # Slots held by one process are interchangeable, so free any of them
+        pid = os.getpid()
+        with self._lock:
+            for slot, owner in enumerate(self._owners):
+                if owner == pid:
+                    self._owners[slot] = 0
+                    return
+
+
+class SharedBuckets:
+    """Token buckets in shared memory, for processes forked after it was created
+
+    Clients are hashed into a fixed table with short linear probing. A slot
+    whose bucket has refilled completely is free for another client to take.
+    """
+
+    PROBES = 8
+
+    def __init__(self, size, capacity, refill_per_second):
+        self.size = size
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self._keys = multiprocessing.RawArray('Q', size)
+        self._tokens = multiprocessing.RawArray('d', size)
+        self._last = multiprocessing.RawArray('d', size)
+
+    def _find(self, client_id):
+        """Slot holding the client's bucket, or one it can take, and the client's key"""
+        digest = hashlib.blake2b(str(client_id).encode(), digest_size=8).digest()
+        key = int.from_bytes(digest, 'little') or 1  # 0 marks an empty slot
+        home = key % self.size
+        now = time.monotonic()
+        free = None
+        for probe in range(self.PROBES):
+            slot = (home + probe) % self.size
+            if self._keys[slot] == key:
+                return slot, key
+            if free is None and (self._keys[slot] == 0 or self._tokens[slot] +
+                                 (now - self._last[slot]) * self.refill_per_second >= self.capacity):
+                free = slot
+        # With every probed slot busy, the client takes over its home slot
+        return (home if free is None else free), key
+
+    def get(self, client_id, default):
+        slot, key = self._find(client_id)
+        if self._keys[slot] != key:
+            return default
+        return self._tokens[slot], self._last[slot]
+
+    def __setitem__(self, client_id, bucket):
+        tokens, last = bucket
+        slot, key = self._find(client_id)
+        self._keys[slot] = key
+        self._tokens[slot] = tokens
+        self._last[slot] = last
+
+    def __contains__(self, client_id):
+        slot, key = self._find(client_id)
+        return self._keys[slot] == key
+
+    def __getitem__(self, client_id):
+        return self.get(client_id, None)
+
+
+class AdmissionController:
+    """Per-request and per-client budgets for generation requests
+
+    Each client gets a token bucket measured in estimated note events.
+    Requests over max_request_cost are rejected outright, and requests
+    over heavy_cost wait for one of a few heavy slots so that a single
+    expensive user can't occupy every worker.
+
+    Buckets and slots belong to this process until share() is called. A
+    server that forks worker processes calls it first, so every worker
+    charges the same budgets and waits for the same heavy slots.
+    """
+
+    def __init__(self, max_request_cost=200_000, client_budget=400_000,
+                 refill_per_second=20_000, heavy_cost=50_000, heavy_slots=2,
+                 queue_timeout=10.0):
+        self.max_request_cost = max_request_cost
+        self.client_budget = client_budget
+        self.refill_per_second = refill_per_second
+        self.heavy_cost = heavy_cost
+        self.queue_timeout = queue_timeout
+        self.heavy_slots = heavy_slots
+        self._heavy_slots = threading.BoundedSemaphore(heavy_slots)
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._exempt = threading.local()
+
+    def share(self, table_size=1 << 16):
+        """Move budgets and heavy slots into memory shared with processes forked later"""
+        self._heavy_slots = SharedSlots(self.heavy_slots)
+        self._buckets = SharedBuckets(table_size, self.client_budget, self.refill_per_second)
+        self._lock = multiprocessing.Lock()
+
+    @contextmanager
+    def exempt(self):
+        """Admit this thread's requests without charging them, e.g. for warm-up"""
+        self._exempt.active = True
+        try:
+            yield
+        finally:
+            self._exempt.active = False
+
+    def _charge(self, client_id, cost):
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(client_id, (self.client_budget, now))
+            tokens = min(self.client_budget, tokens + (now - last) * self.refill_per_second)
+            if tokens < cost:
+                self._buckets[client_id] = (tokens, now)
+                retry_after = (cost - tokens) / self.refill_per_second
+                raise AdmissionError("Generation budget exceeded, try again later",
+                                     status=429, retry_after=int(retry_after) + 1)
+            self._buckets[client_id] = (tokens - cost, now)
+
+            # Forget clients whose bucket has fully refilled; shared slots
+            # are reused by other clients instead
+            if isinstance(self._buckets, dict) and len(self._buckets) > 10_000:
+                full = [c for c, (t, l) in self._buckets.items()
+                        if t + (now - l) * self.refill_per_second >= self.client_budget]
+                for c in full:
+                    del self._buckets[c]
+
+    def _refund(self, client_id, cost):
+        with self._lock:
+            if client_id in self._buckets:
+                tokens, last = self._buckets[client_id]
+                self._buckets[client_id] = (min(self.client_budget, tokens + cost), last)
+
+    def admit(self, client_id, cost):
+        """Charge a request against its budgets and return a Ticket"""
+        if getattr(self._exempt, 'active', False):
+            return Ticket()
+        if cost > self.max_request_cost:
+            raise AdmissionError(f"Request too large: about {cost} events, "
+                                 f"limit is {self.max_request_cost}", status=413)
+        self._charge(client_id, cost)
+        if cost < self.heavy_cost:
+            return Ticket()
+
+        # Queue expensive requests behind a small number of slots
+        if not self._heavy_slots.acquire(timeout=self.queue_timeout):
+            self._refund(client_id, cost)
+            raise AdmissionError("Server busy with other large requests, try again later",
+                                 status=503, retry_after=int(self.queue_timeout))
+        return Ticket(self._heavy_slots)
@@ -1,68 +1,284 @@
-from flask import Flask, render_template, request, send_file, jsonify
+from flask import Flask, render_template, request, send_file, jsonify, Response, stream_with_context, url_for
 from werkzeug.utils import secure_filename
+from werkzeug.middleware.proxy_fix import ProxyFix
 import os
 from main import MelodyGenerator
 import tempfile
 import json
+import gzip
+import hashlib
+import event_export
+import groove
+from admission import AdmissionController, AdmissionError, melody_cost, chord_cost
+from generation_store import GenerationStore, UnknownGeneration
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional, fall back to gzip
+    brotli = None
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.urandom(24)
 app.config['UPLOAD_FOLDER'] = 'static/generated'
 
+# Behind reverse proxies, take the client address from the X-Forwarded-For
+# entry the nearest of them added, so admission budgets are per client and
+# not per proxy. Only trust as many hops as there are proxies in front.
+PROXY_HOPS = int(os.environ.get('PROXY_HOPS', 0))
+if PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_HOPS)
+
 # Ensure the upload folder exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
 # Initialize the melody generator
 generator = MelodyGenerator()
 
+# Responses smaller than this are not worth compressing
+COMPRESS_MIN_BYTES = 1024
+
+# Reject or queue expensive requests before any generation work starts.
+# preload() shares the budgets between server worker processes.
+admission = AdmissionController()
+
+# Generations kept bar by bar so edits only regenerate what changed. They are
+# written to a folder outside the static root so any server process can edit them.
+app.config['GENERATION_FOLDER'] = os.environ.get(
+    'GENERATION_FOLDER', os.path.join(MelodyGenerator.MELODY_CORPUS_DIR, 'generations'))
+generations = GenerationStore(app.config['GENERATION_FOLDER'])
+
+# Precomputed pages only change on deploy, so let clients reuse them briefly
+# and revalidate with the ETag afterwards
+PAGE_CACHE_CONTROL = 'public, max-age=60'
+# Fingerprinted static URLs change whenever the file does
+STATIC_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+static_fingerprints = {}
+
+def static_fingerprint(filename):
+    """Content hash of a static asset as this process serves it"""
+    if filename not in static_fingerprints:
+        with open(os.path.join(app.static_folder, filename), 'rb') as f:
+            static_fingerprints[filename] = hashlib.sha256(f.read()).hexdigest()[:12]
+    return static_fingerprints[filename]
+
+def static_url(filename):
+    """URL for a static asset with a content hash for long-lived caching"""
+    return url_for('static', filename=filename, v=static_fingerprint(filename))
+
+app.jinja_env.globals['static_url'] = static_url
+
+def melody_params(data):
+    """Extract melody generation parameters from a request payload"""
+    return {
+        'root_note': data.get('root_note', 'C').upper(),
+        'mode': data.get('mode', 'major').lower(),
+        'rhythm_pattern': data.get('rhythm_pattern', 'basic').lower(),
+        'bpm': int(data.get('bpm', 120)),
+        'bars': int(data.get('bars', 4)),
+        'use_swing': data.get('use_swing', False),
+        'swing_type': data.get('swing_type', 'medium'),
+        'use_humanization': data.get('use_humanization', False),
+        'humanization_amount': float(data.get('humanization_amount', 0.2)),
+        'note_model': data.get('note_model', 'uniform').lower()
+    }
+
+def chord_params(data):
+    """Extract chord progression parameters from a request payload"""
+    return {
+        'root_note': data.get('root_note', 'C').upper(),
+        'progression_type': data.get('progression_type', 'basic'),
+        'bpm': int(data.get('bpm', 120)),
+        'total_bars': int(data.get('total_bars', 4)),
+        'octave_choice': int(data.get('octave', 2)),
+        'timing_mode': int(data.get('timing_mode', 1)),
+        'chord_type': int(data.get('chord_type', 1)),
+        'inversion': int(data.get('inversion', 0)),
+        'strum_in': data.get('strum_in', 'none'),
+        'strum_out': data.get('strum_out', 'none')
+    }
+
+def groove_params(data):
+    """Extract optional groove post-processing settings from a request payload"""
+    options = data.get('groove')
+    if not options:
+        return None
+    if isinstance(options, str):
+        options = {'template': options}
+    swing_type = options.get('swing')
+    return {
+        'template': options.get('template'),
+        'swing': generator.SWING_AMOUNTS[swing_type] if swing_type else None,
+        'subdivision': float(options.get('subdivision', 0.5)),
+        'timing_jitter': float(options.get('timing_jitter', 0.0)),
+        'velocity_jitter': float(options.get('velocity_jitter', 0.0))
+    }
+
+def sse_message(event, payload):
+    """Format a single server-sent event frame"""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+def stream_bars(bar_events, bpm, ticket):
+    """Stream note events to the browser bar by bar as they are generated"""
+    # Pull the first bar eagerly so bad parameters still get a 400
+    # instead of a stream that breaks after the headers went out
+    try:
+        first_bar = next(bar_events, None)
+    except Exception:
+        ticket.release()
+        raise
+
+    def frames():
+        yield sse_message('meta', {'ticks_per_beat': generator.TICKS_PER_BEAT, 'bpm': bpm})
+        if first_bar is not None:
+            yield sse_message('bar', {'bar': 0, 'events': first_bar})
+            try:
+                for index, events in enumerate(bar_events, 1):
+                    yield sse_message('bar', {'bar': index, 'events': events})
+            except Exception as e:
+                yield sse_message('error', {'message': str(e)})
+                return
+        yield sse_message('end', {})
+
+    response = Response(stream_with_context(frames()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Keep the admission slot until the whole stream has been sent
+    response.call_on_close(ticket.release)
+    return response
+
+def admission_error(e):
+    """Turn a rejected admission into an error response"""
+    response = jsonify({
+        'status': 'error',
+        'message': str(e)
+    })
+    response.status_code = e.status
+    if e.retry_after is not None:
+        response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+class CachedPage:
+    """A response body computed once at startup, served with a strong ETag"""
+
+    def __init__(self, body, mimetype):
+        self.body = body.encode() if isinstance(body, str) else body
+        self.mimetype = mimetype
+        self.etag = hashlib.sha256(self.body).hexdigest()[:32]
+
+    def response(self):
+        response = Response(self.body, mimetype=self.mimetype)
+        response.set_etag(self.etag)
+        response.headers['Cache-Control'] = PAGE_CACHE_CONTROL
+        # Answers If-None-Match revalidation with a 304
+        return response.make_conditional(request)
+
+def build_pages():
+    """Render the index page and options payload once"""
+    with app.test_request_context():
+        index_page = render_template('index.html',
+                                     scales=generator.SCALE_MODES.keys(),
+                                     rhythm_patterns=generator.RHYTHM_PATTERNS.keys(),
+                                     chord_progressions=generator.CHORD_PROGRESSIONS.keys(),
+                                     notes=generator.NOTE_TO_MIDI.keys())
+    options = json.dumps({
+        'scales': list(generator.SCALE_MODES.keys()),
+        'rhythm_patterns': list(generator.RHYTHM_PATTERNS.keys()),
+        'chord_progressions': list(generator.CHORD_PROGRESSIONS.keys()),
+        'notes': list(generator.NOTE_TO_MIDI.keys()),
+        'swing_amounts': list(generator.SWING_AMOUNTS.keys()),
+        'note_models': generator.NOTE_MODELS,
+        'strum_patterns': list(generator.STRUM_PATTERNS.keys()),
+        'groove_templates': list(groove.GROOVE_TEMPLATES.keys())
+    })
+    return CachedPage(index_page, 'text/html'), CachedPage(options, 'application/json')
+
+index_page, options_page = build_pages()
+
+@app.after_request
+def cache_static(response):
+    # Assets requested through static_url carry their fingerprint. Only a
+    # fingerprint of the file this process serves may be cached for good:
+    # during a rolling deploy an old worker can be asked for a new one.
+    version = request.args.get('v')
+    if request.endpoint == 'static' and version and response.status_code in (200, 304):
+        try:
+            current = static_fingerprint(request.view_args['filename'])
+        except OSError:
+            current = None
+        if version == current:
+            response.headers['Cache-Control'] = STATIC_CACHE_CONTROL
+        else:
+            response.headers['Cache-Control'] = PAGE_CACHE_CONTROL
+    return response
+
+def saved_generation(generation):
+    """Store a generation, write its MIDI file and describe it to the client"""
+    generations.add(generation)
+
+    # Create a temporary file to store the MIDI
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.mid', dir=app.config['UPLOAD_FOLDER']) as tmp:
+        generation.save(tmp.name)
+
+    # Get the filename only
+    filename = os.path.basename(tmp.name)
+
+    return jsonify({
+        'status': 'success',
+        'filename': filename,
+        'download_url': f'/download/{filename}',
+        'generation_id': generation.id,
+        'bars': len(generation.bars)
+    })
+
+def compressed_response(body, mimetype):
+    """Build a response, compressing large bodies when the client accepts it"""
+    response = Response(body, mimetype=mimetype)
+    response.vary.add('Accept-Encoding')
+    if len(body) < COMPRESS_MIN_BYTES:
+        return response
+    if brotli is not None and 'br' in request.accept_encodings:
+        response.set_data(brotli.compress(body))
+        response.headers['Content-Encoding'] = 'br'
+    elif 'gzip' in request.accept_encodings:
+        response.set_data(gzip.compress(body, compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+def export_response(events, bpm, output_format, groove_options=None):
+    """Return generated event arrays as a compact payload instead of a MIDI file"""
+    if groove_options:
+        events = groove.apply_groove(events, generator.TICKS_PER_BEAT, **groove_options)
+    if output_format == 'json':
+        payload = event_export.to_json(events, generator.TICKS_PER_BEAT, bpm)
+        return compressed_response(json.dumps(payload, separators=(',', ':')).encode(),
+                                   'application/json')
+    if output_format == 'binary':
+        payload = event_export.to_binary(events, generator.TICKS_PER_BEAT, bpm)
+        return compressed_response(payload, 'application/octet-stream')
+    raise ValueError(f"Unknown output format: {output_format}")
+
 @app.route('/')
 def index():
-    return render_template('index.html',
-                         scales=generator.SCALE_MODES.keys(),
-                         rhythm_patterns=generator.RHYTHM_PATTERNS.keys(),
-                         chord_progressions=generator.CHORD_PROGRESSIONS.keys(),
-                         notes=generator.NOTE_TO_MIDI.keys())
+    return index_page.response()
 
 @app.route('/generate_melody', methods=['POST'])
 def generate_melody():
     try:
         data = request.get_json()
-        
-        # Create a temporary file to store the MIDI
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.mid', dir=app.config['UPLOAD_FOLDER']) as tmp:
-            # Extract parameters from request
-            root_note = data.get('root_note', 'C').upper()
-            mode = data.get('mode', 'major').lower()
-            rhythm_pattern = data.get('rhythm_pattern', 'basic').lower()
-            bpm = int(data.get('bpm', 120))
-            bars = int(data.get('bars', 4))
-            use_swing = data.get('use_swing', False)
-            swing_type = data.get('swing_type', 'medium')
-            use_humanization = data.get('use_humanization', False)
-            humanization_amount = float(data.get('humanization_amount', 0.2))
+        params = melody_params(data)
+
+        with admission.admit(request.remote_addr, melody_cost(generator, params)):
+            # Hand the raw events to the client if it renders the MIDI itself
+            output_format = data.get('format', 'midi').lower()
+            if output_format != 'midi':
+                bpm = params.pop('bpm')
+                events = event_export.collect_events(generator.melody_bar_events(**params))
+                return export_response(events, bpm, output_format, groove_params(data))
 
             # Generate the melody
-            generator.generate_melody_web(
-                output_file=tmp.name,
-                root_note=root_note,
-                mode=mode,
-                rhythm_pattern=rhythm_pattern,
-                bpm=bpm,
-                bars=bars,
-                use_swing=use_swing,
-                swing_type=swing_type,
-                use_humanization=use_humanization,
-                humanization_amount=humanization_amount
-            )
-
-            # Get the filename only
-            filename = os.path.basename(tmp.name)
-            
-            return jsonify({
-                'status': 'success',
-                'filename': filename,
-                'download_url': f'/download/{filename}'
-            })
+            return saved_generation(generator.build_melody(**params))
+    except AdmissionError as e:
+        return admission_error(e)
     except Exception as e:
         return jsonify({
             'status': 'error',
@@ -73,44 +289,87 @@ def generate_melody():
 def generate_chord_progression():
     try:
         data = request.get_json()
-        
-        # Create a temporary file to store the MIDI
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.mid', dir=app.config['UPLOAD_FOLDER']) as tmp:
-            # Extract parameters from request
-            root_note = data.get('root_note', 'C').upper()
-            progression_type = data.get('progression_type', 'basic')
-            bpm = int(data.get('bpm', 120))
-            total_bars = int(data.get('total_bars', 4))
-            octave_choice = int(data.get('octave', 2))
-            timing_mode = int(data.get('timing_mode', 1))
-            chord_type = int(data.get('chord_type', 1))
-            inversion = int(data.get('inversion', 0))
-            strum_in = data.get('strum_in', 'none')
-            strum_out = data.get('strum_out', 'none')
+        params = chord_params(data)
+        generator.check_chord_params(**params)
+
+        with admission.admit(request.remote_addr, chord_cost(generator, params)):
+            # Hand the raw events to the client if it renders the MIDI itself
+            output_format = data.get('format', 'midi').lower()
+            if output_format != 'midi':
+                bpm = params.pop('bpm')
+                return export_response(generator.chord_progression_arrays(**params), bpm, output_format,
+                                       groove_params(data))
 
             # Generate the chord progression
-            generator.generate_chord_progression_web(
-                output_file=tmp.name,
-                root_note=root_note,
-                progression_type=progression_type,
-                bpm=bpm,
-                total_bars=total_bars,
-                octave_choice=octave_choice,
-                timing_mode=timing_mode,
-                chord_type=chord_type,
-                inversion=inversion,
-                strum_in=strum_in,
-                strum_out=strum_out
-            )
-
-            # Get the filename only
-            filename = os.path.basename(tmp.name)
-            
-            return jsonify({
-                'status': 'success',
-                'filename': filename,
-                'download_url': f'/download/{filename}'
-            })
+            return saved_generation(generator.build_chord_progression(**params))
+    except AdmissionError as e:
+        return admission_error(e)
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+
+@app.route('/edit/<generation_id>', methods=['POST'])
+def edit_generation(generation_id):
+    try:
+        data = request.get_json()
+        generation = generations.get(generation_id)
+        start = int(data['start'])
+        end = int(data.get('end', start + 1))
+        chords = data.get('chords')
+        if chords is not None:
+            chords = [int(chord) for chord in chords]
+
+        # Charge only for the bars being regenerated
+        if generation.kind == 'melody':
+            cost = melody_cost(generator, dict(generation.params, bars=end - start))
+        else:
+            full_cost = chord_cost(generator, generation.params)
+            cost = full_cost * (end - start) // max(1, len(generation.bars))
+
+        with admission.admit(request.remote_addr, cost):
+            return saved_generation(generator.regenerate_bars(generation, start, end, chords))
+    except UnknownGeneration as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 404
+    except AdmissionError as e:
+        return admission_error(e)
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+
+@app.route('/stream_melody', methods=['POST'])
+def stream_melody():
+    try:
+        params = melody_params(request.get_json())
+        ticket = admission.admit(request.remote_addr, melody_cost(generator, params))
+        bpm = params.pop('bpm')
+        return stream_bars(generator.melody_bar_events(**params), bpm, ticket)
+    except AdmissionError as e:
+        return admission_error(e)
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+
+@app.route('/stream_chord_progression', methods=['POST'])
+def stream_chord_progression():
+    try:
+        params = chord_params(request.get_json())
+        # Only the first bar is generated before the stream starts, so check
+        # the whole request now rather than fail part way through
+        generator.check_chord_params(**params)
+        ticket = admission.admit(request.remote_addr, chord_cost(generator, params))
+        bpm = params.pop('bpm')
+        return stream_bars(generator.chord_progression_bar_events(**params), bpm, ticket)
+    except AdmissionError as e:
+        return admission_error(e)
     except Exception as e:
         return jsonify({
             'status': 'error',
@@ -130,14 +389,29 @@ def download_file(filename):
 
 @app.route('/get_options')
 def get_options():
-    return jsonify({
-        'scales': list(generator.SCALE_MODES.keys()),
-        'rhythm_patterns': list(generator.RHYTHM_PATTERNS.keys()),
-        'chord_progressions': list(generator.CHORD_PROGRESSIONS.keys()),
-        'notes': list(generator.NOTE_TO_MIDI.keys()),
-        'swing_amounts': list(generator.SWING_AMOUNTS.keys()),
-        'strum_patterns': list(generator.STRUM_PATTERNS.keys())
-    })
+    return options_page.response()
+
+def preload():
+    """Build shared tables in the server process before workers are forked"""
+    generator.preload_tables()
+    admission.share()
+
+def warm_up():
+    """Run a small generation of each kind so a new worker's first requests are fast"""
+    client = app.test_client()
+    requests = [('/generate_melody', {'bars': 1, 'note_model': note_model, 'format': 'binary'})
+                for note_model in generator.NOTE_MODELS]
+    requests.append(('/generate_chord_progression', {'format': 'binary', 'strum_in': 'down_med'}))
+    for path, payload in requests:
+        # Warm-up requests come from this process, not a client with a budget
+        with admission.exempt():
+            response = client.post(path, json=payload)
+        # A worker that can't generate should fail to boot, not serve errors
+        if response.status_code != 200:
+            raise RuntimeError(f"Warm-up request to {path} failed with {response.status}: "
+                               f"{response.get_data(as_text=True)[:200]}")
+    # Encoded chord segments are only built on the MIDI file path
+    generator.build_chord_progression('C', 'basic', 120, 4, 2, 1, 1, 0, 'none', 'none')
 
 if __name__ == '__main__':
-    app.run(debug=True) 
\ No newline at end of file
+    app.run(debug=True)
@@ -0,0 +1,257 @@
+"""Generate a corpus of MIDI files in batch, on one or many machines
+
+Work units go through a broker: a SQLite database on one host, or a
+coordinator serving that database over TCP to workers on other nodes.
+
+    python batch.py submit corpus.db --kind melody --count 100 --param mode=major,minor
+    python batch.py worker corpus.db --processes 4
+    python batch.py coordinator corpus.db --host 0.0.0.0 --port 8750
+    python batch.py worker coordinator-host:8750 --processes 8
+    python batch.py status corpus.db
+
+Results are written to corpus.db.results/ named by their content hash.
+
+A coordinator serves anyone who can reach its port. Set BATCH_TOKEN to the
+same secret on the coordinator and every node so it only serves them, and
+keep it on a trusted network: the traffic is not encrypted.
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import random
+import socket
+import sys
+import time
+from multiprocessing import Process, Queue
+import numpy as np
+import broker
+from shm_ring import ResultRing
+
+# Batch workers never play audio, so don't let pygame look for a sound card
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+# Parameters of each kind of unit when a submission doesn't set them
+DEFAULT_PARAMS = {
+    'melody': {
+        'root_note': 'C', 'mode': 'major', 'rhythm_pattern': 'basic', 'bpm': 120, 'bars': 4,
+        'use_swing': False, 'swing_type': 'medium', 'use_humanization': False,
+        'humanization_amount': 0.2, 'note_model': 'uniform'
+    },
+    'chords': {
+        'root_note': 'C', 'progression_type': 'basic', 'bpm': 120, 'total_bars': 4,
+        'octave_choice': 2, 'timing_mode': 1, 'chord_type': 1, 'inversion': 0,
+        'strum_in': 'none', 'strum_out': 'none'
+    }
+}
+
+
+def unit_key(unit):
+    """Idempotency key of a work unit: the hash of its canonical form"""
+    return hashlib.sha256(json.dumps(unit, sort_keys=True).encode()).hexdigest()[:32]
+
+
+def make_units(kind, count, seed=0, grid=None):
+    """One unit per seed for every combination of the grid's parameter values"""
+    grid = grid or {}
+    names = list(grid)
+    units = {}
+    for values in itertools.product(*(grid[name] for name in names)):
+        params = dict(DEFAULT_PARAMS[kind], **dict(zip(names, values)))
+        for unit_seed in range(seed, seed + count):
+            unit = {'kind': kind, 'params': params, 'seed': unit_seed}
+            units[unit_key(unit)] = unit
+    return units
+
+
+def build_unit(generator, unit):
+    """Generate one unit
+
+    Random state is seeded from the unit, so a retry on another node
+    produces the same file.
+    """
+    random.seed(unit['seed'])
+    np.random.seed(unit['seed'] % 2 ** 32)
+    if unit['kind'] == 'melody':
+        return generator.build_melody(**unit['params'])
+    if unit['kind'] == 'chords':
+        return generator.build_chord_progression(**unit['params'])
+    raise ValueError(f"Unknown unit kind: {unit['kind']}")
+
+
+def queue_drained(work):
+    """True once no unit is pending or leased anywhere"""
+    status = work.status()
+    return not status['pending'] and not status['leased']
+
+
+def run_worker(target, worker_id, batch_size=8, lease_seconds=120, poll_interval=1.0):
+    """Lease, render and complete units in this process until the broker has none left"""
+    from main import MelodyGenerator
+    generator = MelodyGenerator()
+    work = broker.connect(target)
+    done = 0
+    while True:
+        units = work.lease(worker_id, batch_size, lease_seconds)
+        if not units:
+            if queue_drained(work):
+                return done
+            # Leases held by other workers may still expire and come back
+            time.sleep(poll_interval)
+            continue
+        for key, unit, attempt in units:
+            try:
+                data = build_unit(generator, unit).to_bytes()
+            except Exception as e:
+                work.fail(key, worker_id, f"attempt {attempt}: {e}")
+                continue
+            work.complete(key, worker_id, data)
+            done += 1
+
+
+def render_worker(tasks, ring):
+    """Render units from the task queue straight into the result ring"""
+    from main import MelodyGenerator
+    generator = MelodyGenerator()
+    for key, unit, attempt in iter(tasks.get, None):
+        try:
+            generation = build_unit(generator, unit)
+            ring.put(key, generation.write_into, generation.file_size)
+        except Exception as e:
+            ring.put_error(key, f"attempt {attempt}: {e}")
+
+
+def run_node(target, worker_id, processes, batch_size=8, lease_seconds=120, poll_interval=1.0,
+             ring_slots=None, slot_size=1 << 20):
+    """Render units in a pool of processes, completing them from this one
+
+    Only this process talks to the broker. Workers write finished files
+    into a shared memory ring, and results are stored straight from it
+    without being pickled or copied back.
+    """
+    ring = ResultRing(ring_slots or 4 * processes, slot_size)
+    tasks = Queue()
+    workers = [Process(target=render_worker, args=(tasks, ring)) for _ in range(processes)]
+    for process in workers:
+        process.start()
+
+    work = broker.connect(target)
+    in_flight = done = 0
+    try:
+        while True:
+            # Keep every worker's queue topped up, leasing a batch at a time
+            if in_flight <= (processes - 1) * batch_size:
+                units = work.lease(worker_id, batch_size, lease_seconds)
+                for unit in units:
+                    tasks.put(unit)
+                in_flight += len(units)
+                if not in_flight:
+                    if queue_drained(work):
+                        return done
+                    time.sleep(poll_interval)
+                    continue
+
+            try:
+                result = ring.get(timeout=poll_interval)
+            except TimeoutError:
+                # Units held by a dead worker return to the queue when their lease runs out
+                if not all(process.is_alive() for process in workers):
+                    raise RuntimeError("A render worker exited unexpectedly") from None
+                continue
+            with result:
+                if result.error is not None:
+                    work.fail(result.key, worker_id, result.error)
+                else:
+                    work.complete(result.key, worker_id, result.view)
+                    done += 1
+            in_flight -= 1
+    finally:
+        for _ in workers:
+            tasks.put(None)
+        for process in workers:
+            # A worker waiting for a free slot after an error would never finish
+            process.join(timeout=lease_seconds)
+            if process.is_alive():
+                process.terminate()
+        ring.close()
+
+
+def parse_grid(params):
+    """Turn name=value1,value2 options into lists of JSON-decoded values"""
+    grid = {}
+    for param in params:
+        name, _, values = param.partition('=')
+        decoded = []
+        for value in values.split(','):
+            try:
+                decoded.append(json.loads(value))
+            except ValueError:
+                decoded.append(value)
+        grid[name] = decoded
+    return grid
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate MIDI corpora in batch")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    submit = commands.add_parser('submit', help="queue work units")
+    submit.add_argument('broker', help="SQLite database path or coordinator host:port")
+    submit.add_argument('--kind', choices=sorted(DEFAULT_PARAMS), default='melody')
+    submit.add_argument('--count', type=int, default=1, help="seeds per parameter combination")
+    submit.add_argument('--seed', type=int, default=0, help="first seed")
+    submit.add_argument('--param', action='append', default=[], metavar='NAME=V1,V2',
+                        help="parameter values to combine, may be repeated")
+
+    worker = commands.add_parser('worker', help="render queued units")
+    worker.add_argument('broker')
+    worker.add_argument('--processes', type=int, default=1)
+    worker.add_argument('--batch-size', type=int, default=8, help="units leased per request")
+    worker.add_argument('--lease-seconds', type=float, default=120)
+
+    coordinator = commands.add_parser('coordinator', help="serve a SQLite broker to other nodes")
+    coordinator.add_argument('broker', help="SQLite database path")
+    coordinator.add_argument('--host', default='127.0.0.1')
+    coordinator.add_argument('--port', type=int, default=8750)
+    coordinator.add_argument('--max-attempts', type=int, default=3)
+
+    status = commands.add_parser('status', help="show unit counts")
+    status.add_argument('broker')
+    args = parser.parse_args()
+
+    if args.command == 'submit':
+        units = make_units(args.kind, args.count, args.seed, parse_grid(args.param))
+        added = broker.connect(args.broker).submit(units)
+        print(f"Queued {added} new units ({len(units) - added} already known)")
+    elif args.command == 'worker':
+        # Make sure the queue exists before the workers race to create it
+        broker.connect(args.broker).status()
+        worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        if args.processes == 1:
+            done = run_worker(args.broker, worker_id, args.batch_size, args.lease_seconds)
+        else:
+            done = run_node(args.broker, worker_id, args.processes, args.batch_size,
+                            args.lease_seconds)
+        print(f"Rendered {done} units")
+        print(json.dumps(broker.connect(args.broker).status()))
+    elif args.command == 'coordinator':
+        local = broker.SQLiteBroker(args.broker, max_attempts=args.max_attempts)
+        token = os.environ.get(broker.TOKEN_ENV)
+        if token is None and args.host not in ('127.0.0.1', 'localhost', '::1'):
+            print(f"Warning: serving {args.host} without {broker.TOKEN_ENV}; "
+                  "any host that can reach the port can use the queue", file=sys.stderr)
+        with broker.Coordinator(local, args.host, args.port, token) as server:
+            print(f"Serving {args.broker} on {args.host}:{args.port}")
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+    elif args.command == 'status':
+        counts = broker.connect(args.broker).status()
+        print(json.dumps(counts))
+        sys.exit(1 if counts['failed'] else 0)
+
+
+if __name__ == '__main__':
+    main()
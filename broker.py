@@ -0,0 +1,274 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import socket
+import socketserver
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+# Shared secret a coordinator requires from its workers, if set
+TOKEN_ENV = 'BATCH_TOKEN'
+
+
+class Broker(ABC):
+    """Hands out batch work units to workers and collects their results
+
+    Units are dicts addressed by an idempotency key, so submitting the same
+    unit twice queues it once. A worker leases units for a limited time; a
+    unit whose lease runs out before it completes goes back to the queue.
+    Results are stored by content hash, so identical outputs are kept once.
+    """
+
+    @abstractmethod
+    def submit(self, units):
+        """Queue {key: unit} work units, returning how many were new"""
+
+    @abstractmethod
+    def lease(self, worker_id, count=1, lease_seconds=120):
+        """Take up to count units as [(key, unit, attempt)]"""
+
+    @abstractmethod
+    def complete(self, key, worker_id, data):
+        """Store a unit's result, returning its content hash"""
+
+    @abstractmethod
+    def fail(self, key, worker_id, error):
+        """Give a unit back after an error; it is retried until max_attempts"""
+
+    @abstractmethod
+    def status(self):
+        """Number of units in each state"""
+
+    @abstractmethod
+    def results(self):
+        """Content hash of every completed unit by key"""
+
+
+class SQLiteBroker(Broker):
+    """Broker kept in a SQLite database, shared by every process on one host
+
+    Result files are written to results_dir, named by their content hash.
+    """
+
+    def __init__(self, path, results_dir=None, max_attempts=3, suffix='.mid'):
+        self.path = path
+        self.results_dir = results_dir or f"{path}.results"
+        self.max_attempts = max_attempts
+        self.suffix = suffix
+        os.makedirs(self.results_dir, exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""CREATE TABLE IF NOT EXISTS units (
+                key TEXT PRIMARY KEY,
+                unit TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                worker TEXT,
+                lease_expires REAL,
+                result TEXT,
+                error TEXT
+            )""")
+            db.execute("CREATE INDEX IF NOT EXISTS units_state ON units (state, lease_expires)")
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            yield db
+        finally:
+            # Closing rolls back a transaction left open by an error
+            db.close()
+
+    def result_path(self, content_hash):
+        return os.path.join(self.results_dir, content_hash + self.suffix)
+
+    def submit(self, units):
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            before = db.total_changes
+            db.executemany("INSERT OR IGNORE INTO units (key, unit) VALUES (?, ?)",
+                           ((key, json.dumps(unit, sort_keys=True)) for key, unit in units.items()))
+            added = db.total_changes - before
+            db.execute("COMMIT")
+        return added
+
+    def lease(self, worker_id, count=1, lease_seconds=120):
+        now = time.time()
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            # Units whose lease ran out have used up an attempt
+            db.execute("""UPDATE units SET state = 'failed', error = 'lease expired'
+                          WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?""",
+                       (now, self.max_attempts))
+            rows = db.execute("""SELECT key, unit, attempts FROM units
+                                 WHERE state = 'pending' OR (state = 'leased' AND lease_expires < ?)
+                                 LIMIT ?""", (now, count)).fetchall()
+            db.executemany("""UPDATE units SET state = 'leased', worker = ?, lease_expires = ?,
+                              attempts = attempts + 1 WHERE key = ?""",
+                           ((worker_id, now + lease_seconds, key) for key, _, _ in rows))
+            db.execute("COMMIT")
+        return [(key, json.loads(unit), attempts + 1) for key, unit, attempts in rows]
+
+    def complete(self, key, worker_id, data):
+        content_hash = hashlib.sha256(data).hexdigest()
+        path = self.result_path(content_hash)
+        if not os.path.exists(path):
+            partial_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(partial_path, 'wb') as f:
+                f.write(data)
+            os.replace(partial_path, path)
+        with self._connect() as db:
+            # A late result for a unit another worker finished is the same
+            # content, so the first one recorded wins
+            db.execute("""UPDATE units SET state = 'done', result = ?, worker = ?, error = NULL
+                          WHERE key = ? AND state != 'done'""", (content_hash, worker_id, key))
+        return content_hash
+
+    def fail(self, key, worker_id, error):
+        with self._connect() as db:
+            db.execute("""UPDATE units SET error = ?,
+                          state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END
+                          WHERE key = ? AND state = 'leased' AND worker = ?""",
+                       (error, self.max_attempts, key, worker_id))
+
+    def status(self):
+        with self._connect() as db:
+            counts = dict(db.execute("SELECT state, COUNT(*) FROM units GROUP BY state").fetchall())
+        return {state: counts.get(state, 0) for state in ('pending', 'leased', 'done', 'failed')}
+
+    def results(self):
+        with self._connect() as db:
+            return dict(db.execute("SELECT key, result FROM units WHERE state = 'done'").fetchall())
+
+
+# Broker methods a coordinator answers for remote workers
+REMOTE_METHODS = ('submit', 'lease', 'complete', 'fail', 'status', 'results')
+
+
+class CoordinatorHandler(socketserver.StreamRequestHandler):
+    """Serve one worker connection: a JSON request per line, a JSON response per line"""
+
+    def authorized(self, request):
+        token = self.server.token
+        if token is None:
+            return True
+        given = request.get('token')
+        return isinstance(given, str) and hmac.compare_digest(given.encode(), token.encode())
+
+    def handle(self):
+        broker = self.server.broker
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                if not self.authorized(request):
+                    # Tell the peer why, then drop it without serving anything
+                    self.wfile.write(json.dumps({'error': "Invalid batch token"}).encode() + b'\n')
+                    return
+                method = request['method']
+                if method not in REMOTE_METHODS:
+                    raise ValueError(f"Unknown method: {method}")
+                args = request.get('args', {})
+                if method == 'complete':
+                    args['data'] = base64.b64decode(args['data'])
+                response = {'result': getattr(broker, method)(**args)}
+            except Exception as e:
+                response = {'error': str(e)}
+            self.wfile.write(json.dumps(response).encode() + b'\n')
+
+
+class Coordinator(socketserver.ThreadingTCPServer):
+    """TCP front end that lets workers on other nodes share one broker
+
+    With a token, only requests carrying the same token are served. The
+    token and the traffic are sent in the clear, so only run a coordinator
+    on a trusted network or behind a tunnel.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, broker, host='127.0.0.1', port=8750, token=None):
+        self.broker = broker
+        self.token = token
+        super().__init__((host, port), CoordinatorHandler)
+
+
+class RemoteBroker(Broker):
+    """Broker client talking to a Coordinator over TCP"""
+
+    def __init__(self, host, port, timeout=60, token=None):
+        self.address = (host, port)
+        self.timeout = timeout
+        self.token = token
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def _call(self, method, **args):
+        request = {'method': method, 'args': args}
+        if self.token is not None:
+            request['token'] = self.token
+        message = json.dumps(request).encode() + b'\n'
+        with self._lock:
+            # Reconnect once if the coordinator dropped the connection
+            for retry in (False, True):
+                try:
+                    if self._connection is None:
+                        sock = socket.create_connection(self.address, timeout=self.timeout)
+                        self._connection = (sock, sock.makefile('rb'))
+                    sock, reader = self._connection
+                    sock.sendall(message)
+                    line = reader.readline()
+                    if not line:
+                        raise ConnectionError("Coordinator closed the connection")
+                    break
+                except OSError:
+                    self.close()
+                    if retry:
+                        raise
+        response = json.loads(line)
+        if 'error' in response:
+            raise RuntimeError(response['error'])
+        return response['result']
+
+    def close(self):
+        if self._connection is not None:
+            sock, reader = self._connection
+            reader.close()
+            sock.close()
+            self._connection = None
+
+    def submit(self, units):
+        return self._call('submit', units=units)
+
+    def lease(self, worker_id, count=1, lease_seconds=120):
+        return [tuple(item) for item in self._call('lease', worker_id=worker_id, count=count,
+                                                   lease_seconds=lease_seconds)]
+
+    def complete(self, key, worker_id, data):
+        return self._call('complete', key=key, worker_id=worker_id,
+                          data=base64.b64encode(data).decode('ascii'))
+
+    def fail(self, key, worker_id, error):
+        return self._call('fail', key=key, worker_id=worker_id, error=error)
+
+    def status(self):
+        return self._call('status')
+
+    def results(self):
+        return self._call('results')
+
+
+def connect(target, results_dir=None, token=None):
+    """Open a broker from a SQLite path or a coordinator's host:port
+
+    A coordinator's token defaults to the BATCH_TOKEN environment variable.
+    """
+    host, _, port = target.rpartition(':')
+    if host and port.isdigit() and not os.path.exists(target):
+        return RemoteBroker(host, int(port), token=token or os.environ.get(TOKEN_ENV))
+    return SQLiteBroker(target, results_dir)
@@ -0,0 +1,68 @@
+import struct
+import numpy as np
+from smf import STATUS_BYTES
+
+
+# Binary payload layout (little endian):
+#   header  - magic, format version, ticks per beat, bpm, event count
+#   delta   - uint32[count] delta times in ticks
+#   status  - uint8[count]  MIDI status byte (0x90 note on, 0x80 note off)
+#   note    - uint8[count]
+#   velocity- uint8[count]
+MAGIC = b'MGEV'
+VERSION = 1
+HEADER = struct.Struct('<4sBHHI')
+
+
+def collect_events(bar_events):
+    """Flatten per-bar (type, note, velocity, time) tuples into integer arrays"""
+    events = [event for bar in bar_events for event in bar]
+    if not events:
+        empty = np.zeros(0, dtype=np.uint8)
+        return np.zeros(0, dtype=np.uint32), empty, empty, empty
+
+    msg_types, notes, velocities, times = zip(*events)
+    count = len(events)
+    delta = np.fromiter(times, dtype=np.uint32, count=count)
+    status = np.fromiter((STATUS_BYTES[t] for t in msg_types), dtype=np.uint8, count=count)
+    note = np.fromiter(notes, dtype=np.uint8, count=count)
+    velocity = np.fromiter(velocities, dtype=np.uint8, count=count)
+    return delta, status, note, velocity
+
+
+def to_json(events, ticks_per_beat, bpm):
+    """Encode (delta, status, note, velocity) arrays as parallel integer lists"""
+    delta, status, note, velocity = events
+    return {
+        'ticks_per_beat': ticks_per_beat,
+        'bpm': bpm,
+        'count': len(delta),
+        'delta': delta.tolist(),
+        'status': status.tolist(),
+        'note': note.tolist(),
+        'velocity': velocity.tolist()
+    }
+
+
+def to_binary(events, ticks_per_beat, bpm):
+    """Encode (delta, status, note, velocity) arrays as a packed binary payload"""
+    delta, status, note, velocity = events
+    header = HEADER.pack(MAGIC, VERSION, ticks_per_beat, bpm, len(delta))
+    return b''.join([header, delta.astype('<u4').tobytes(), status.astype(np.uint8).tobytes(),
+                     note.astype(np.uint8).tobytes(), velocity.astype(np.uint8).tobytes()])
+
+
+def from_binary(payload):
+    """Decode a packed binary payload back into its header and arrays"""
+    magic, version, ticks_per_beat, bpm, count = HEADER.unpack_from(payload)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a packed event payload")
+    offset = HEADER.size
+    delta = np.frombuffer(payload, dtype='<u4', count=count, offset=offset)
+    offset += count * 4
+    status, note, velocity = (
+        np.frombuffer(payload, dtype=np.uint8, count=count, offset=offset + i * count)
+        for i in range(3)
+    )
+    return {'ticks_per_beat': ticks_per_beat, 'bpm': bpm,
+            'delta': delta, 'status': status, 'note': note, 'velocity': velocity}
@@ -0,0 +1,186 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+import smf
+
+# Generation ids are the first 16 hex digits of a content hash
+GENERATION_ID = re.compile(r'[0-9a-f]{16}')
+
+
+class UnknownGeneration(LookupError):
+    """No generation is stored under the requested id"""
+
+
+class Generation:
+    """A generated track kept as a header plus individually encoded bars
+
+    Bars are independent byte chunks, so an edit only re-encodes the bars
+    it touches and splices them back between the untouched ones.
+    """
+
+    def __init__(self, kind, params, header, bars, ticks_per_beat, midi_type=0,
+                 chords=None, voicings=None):
+        self.kind = kind
+        self.params = params
+        self.header = header
+        self.bars = bars
+        self.ticks_per_beat = ticks_per_beat
+        self.midi_type = midi_type
+        # Scale degree and played notes of each bar for chord progressions
+        self.chords = chords
+        self.voicings = voicings
+        self.track_data = header + b''.join(bars)
+        # Tempo and other settings aren't always in the track, so they are
+        # part of the identity along with the bytes
+        identity = hashlib.sha256(json.dumps([kind, params], sort_keys=True).encode())
+        identity.update(self.track_data)
+        self.id = identity.hexdigest()[:16]
+
+    def splice(self, start, bars, chords=None, voicings=None):
+        """Return a new generation with bars replaced from start onwards"""
+        def replace(items, new_items):
+            if new_items is None:
+                return items
+            return items[:start] + new_items + items[start + len(new_items):]
+
+        return Generation(self.kind, self.params, self.header, replace(self.bars, bars),
+                          self.ticks_per_beat, self.midi_type,
+                          replace(self.chords, chords), replace(self.voicings, voicings))
+
+    @property
+    def file_size(self):
+        return smf.FILE_HEADER.size + len(self.track_data) + len(smf.END_OF_TRACK)
+
+    def to_bytes(self):
+        return smf.file_bytes(self.track_data, self.ticks_per_beat, self.midi_type)
+
+    def write_into(self, buffer):
+        return smf.write_into(buffer, self.track_data, self.ticks_per_beat, self.midi_type)
+
+    def save(self, output_file):
+        smf.write_file(output_file, self.track_data, self.ticks_per_beat, self.midi_type)
+
+    def dump(self):
+        """Serialize as a line of JSON followed by the raw header and bar bytes"""
+        meta = {
+            'kind': self.kind, 'params': self.params,
+            'ticks_per_beat': self.ticks_per_beat, 'midi_type': self.midi_type,
+            'chords': None if self.chords is None else [int(c) for c in self.chords],
+            'voicings': None if self.voicings is None else
+                        [[int(n) for n in voicing] for voicing in self.voicings],
+            'header_length': len(self.header),
+            'bar_lengths': [len(bar) for bar in self.bars]
+        }
+        return json.dumps(meta, sort_keys=True).encode() + b'\n' + self.track_data
+
+    @classmethod
+    def load(cls, data):
+        """Rebuild a generation written by dump"""
+        line, _, track_data = data.partition(b'\n')
+        meta = json.loads(line)
+        position = meta['header_length']
+        header = track_data[:position]
+        bars = []
+        for length in meta['bar_lengths']:
+            bars.append(track_data[position:position + length])
+            position += length
+        if position != len(track_data):
+            raise ValueError("Stored generation is truncated")
+        voicings = meta['voicings']
+        if voicings is not None:
+            voicings = [tuple(voicing) for voicing in voicings]
+        return cls(meta['kind'], meta['params'], header, bars, meta['ticks_per_beat'],
+                   meta['midi_type'], meta['chords'], voicings)
+
+
+class GenerationStore:
+    """Store of generations, addressed by content hash
+
+    With a directory, every generation is also written there, so server
+    processes sharing the directory can edit each other's generations. An
+    LRU of recent generations in memory saves reading them back. Files
+    expire max_age seconds after they were last stored, and only the
+    newest max_files are kept.
+    """
+
+    def __init__(self, directory=None, max_entries=256, max_age=24 * 3600, max_files=10_000,
+                 prune_interval=60):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.max_files = max_files
+        self.prune_interval = prune_interval
+        self._generations = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_prune = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, generation_id):
+        return os.path.join(self.directory, f"{generation_id}.generation")
+
+    def prune(self):
+        """Delete expired files, then the oldest ones over max_files"""
+        now = time.time()
+        files = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.generation'):
+                continue
+            try:
+                mtime = entry.stat().st_mtime
+            except FileNotFoundError:
+                continue  # Pruned by another process
+            files.append((mtime, entry.path))
+        files.sort(reverse=True)
+        for index, (mtime, path) in enumerate(files):
+            if index >= self.max_files or now - mtime > self.max_age:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def _remember(self, generation):
+        with self._lock:
+            self._generations[generation.id] = generation
+            self._generations.move_to_end(generation.id)
+            if len(self._generations) > self.max_entries:
+                self._generations.popitem(last=False)
+
+    def add(self, generation):
+        self._remember(generation)
+        if self.directory:
+            # Rewriting an existing file restarts its expiry
+            path = self._path(generation.id)
+            partial_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(partial_path, 'wb') as f:
+                f.write(generation.dump())
+            os.replace(partial_path, path)
+            if time.time() - self._last_prune > self.prune_interval:
+                self._last_prune = time.time()
+                self.prune()
+        return generation.id
+
+    def get(self, generation_id):
+        with self._lock:
+            generation = self._generations.get(generation_id)
+            if generation is not None:
+                self._generations.move_to_end(generation_id)
+                return generation
+        # Only ids this store could have written name a file in its directory
+        if self.directory and GENERATION_ID.fullmatch(generation_id):
+            path = self._path(generation_id)
+            try:
+                if time.time() - os.path.getmtime(path) <= self.max_age:
+                    with open(path, 'rb') as f:
+                        generation = Generation.load(f.read())
+                    # A file that doesn't hash to its name is not one we wrote
+                    if generation.id == generation_id:
+                        self._remember(generation)
+                        return generation
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+        raise UnknownGeneration(f"Unknown generation: {generation_id}")
@@ -0,0 +1,89 @@
+import numpy as np
+from strum import NOTE_ON
+
+
+# Per-sixteenth groove templates over one beat: timing offset as a fraction
+# of a sixteenth note and a velocity scale for notes starting on that step
+GROOVE_TEMPLATES = {
+    "straight": ([0.0, 0.0, 0.0, 0.0], [1.0, 1.0, 1.0, 1.0]),
+    "accented": ([0.0, 0.0, 0.0, 0.0], [1.15, 0.85, 0.95, 0.85]),
+    "laid_back": ([0.0, 0.12, 0.08, 0.15], [1.05, 0.9, 0.95, 0.9]),
+    "push": ([0.0, -0.1, -0.05, -0.12], [1.05, 0.95, 1.0, 0.95]),
+    "shuffle": ([0.0, 0.33, 0.0, 0.33], [1.1, 0.8, 1.0, 0.8]),
+    "mpc": ([0.0, 0.2, 0.05, 0.25], [1.1, 0.75, 0.95, 0.8])
+}
+
+
+def _warp(times, cycle, xs, ys):
+    """Remap positions within a repeating cycle through a monotonic curve"""
+    position = np.mod(times, cycle)
+    return times - position + np.interp(position, xs, ys)
+
+
+def apply_groove(events, ticks_per_beat, lengths=None, template=None, swing=None,
+                 subdivision=0.5, timing_jitter=0.0, velocity_jitter=0.0, rng=None):
+    """Apply swing, a groove template and humanization to note event arrays
+
+    events is a (delta, status, note, velocity) tuple of arrays. Several
+    tracks can be processed in one call by concatenating their arrays and
+    passing the number of events in each as lengths.
+
+    swing is the fraction of a subdivision pair taken by the on-beat note
+    (0.5 is straight, see MelodyGenerator.SWING_AMOUNTS). timing_jitter is
+    the standard deviation of note shifts as a fraction of a sixteenth,
+    velocity_jitter the standard deviation of note-on velocity changes.
+    """
+    delta, status, note, velocity = (np.asarray(column) for column in events)
+    count = len(delta)
+    if lengths is None:
+        lengths = [count]
+    lengths = np.asarray(lengths, dtype=np.int64)
+    rng = rng if rng is not None else np.random.default_rng()
+    sixteenth = ticks_per_beat / 4
+
+    # Absolute times within each track
+    track = np.repeat(np.arange(len(lengths)), lengths)
+    track_start = np.zeros(len(lengths), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=track_start[1:])
+    running = np.concatenate(([0.0], np.cumsum(delta, dtype=np.float64)))
+    times = running[1:] - running[track_start][track]
+    velocity = velocity.astype(np.float64)
+    is_on = status == NOTE_ON
+
+    if swing is not None and swing != 0.5:
+        # Delay every second subdivision; on and off events move alike
+        grid = ticks_per_beat * subdivision
+        times = _warp(times, 2 * grid, [0, grid, 2 * grid], [0, 2 * grid * swing, 2 * grid])
+
+    if template is not None:
+        offsets, accents = (np.asarray(values, dtype=np.float64) for values in GROOVE_TEMPLATES[template])
+        steps = len(offsets)
+        step_index = np.rint(times / sixteenth).astype(np.int64) % steps
+        velocity = np.where(is_on, velocity * accents[step_index], velocity)
+
+        xs = np.arange(steps + 1) * sixteenth
+        ys = xs + np.append(offsets, offsets[0]) * sixteenth
+        times = _warp(times, steps * sixteenth, xs, ys)
+
+    if timing_jitter:
+        # Pair each note-off with the note-on it ends (same track and pitch,
+        # in order) so that a shifted note keeps its length
+        order = np.lexsort((np.arange(count), note, track))
+        pair = np.empty(count, dtype=np.int64)
+        pair[order] = np.maximum(np.cumsum(is_on[order]) - 1, 0)
+        shifts = rng.normal(0, timing_jitter * sixteenth, size=max(1, int(is_on.sum())))
+        times = np.maximum(0, times + shifts[pair])
+
+    if velocity_jitter:
+        velocity = np.where(is_on, velocity + rng.normal(0, velocity_jitter, size=count), velocity)
+
+    velocity = np.where(is_on, np.clip(np.rint(velocity), 1, 127), np.clip(np.rint(velocity), 0, 127))
+    times = np.rint(times).astype(np.int64)
+
+    # Restore time order within each track, keeping ties in their original order
+    order = np.lexsort((np.arange(count), times, track))
+    times = times[order]
+    new_delta = np.diff(times, prepend=0)
+    starts = track_start[lengths > 0]
+    new_delta[starts] = times[starts]
+    return new_delta, status[order], note[order], velocity[order].astype(np.int64)
@@ -0,0 +1,49 @@
+"""Production server settings
+
+    gunicorn -c gunicorn.conf.py app:app
+
+The app is imported and its tables are built once in the master process.
+Workers are forked from it and share those tables copy-on-write, along with
+one set of admission budgets, and each worker runs a warm-up generation
+before it accepts requests.
+
+Send HUP to replace the workers gracefully with the configuration reloaded.
+Because the app is preloaded, code changes need a new master: send USR2 to
+start one next to the old one, then QUIT to the old master once it is up.
+"""
+import gc
+import multiprocessing
+import os
+import random
+import numpy as np
+
+# The server never plays audio, so don't let pygame look for a sound card
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+bind = os.environ.get('BIND', f"0.0.0.0:{os.environ.get('PORT', '8000')}")
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+# Streaming responses can run for a while; give them time to finish on reload
+timeout = int(os.environ.get('TIMEOUT', 60))
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT', 30))
+preload_app = True
+
+
+def when_ready(server):
+    import app
+    app.preload()
+    # Keep the preloaded objects out of garbage collection so the collector
+    # does not touch, and so copy, the pages workers share
+    gc.freeze()
+    server.log.info("Preloaded generator tables")
+
+
+def post_fork(server, worker):
+    # Forked workers start with the master's random state; give each its own
+    random.seed()
+    np.random.seed()
+
+
+def post_worker_init(worker):
+    import app
+    app.warm_up()
+    worker.log.info("Worker warmed up")
@@ -1,9 +1,16 @@
 import os
+import glob
 import time
 from mido import Message, MidiFile, MidiTrack, bpm2tempo, MetaMessage
 import random
 import pygame
 import numpy as np
+import smf
+import strum
+from segment_cache import SegmentCache
+from generation_store import Generation
+from voicing import VoiceLeader
+from melody_model import MelodyModel, scale_offsets
 
 
 class MelodyGenerator:
@@ -69,9 +76,81 @@ class MelodyGenerator:
         "alt_fast": {"direction": "alt", "speed": 5}
     }
 
+    TICKS_PER_BEAT = 480
+
+    # Chord intervals used by the web generators
+    CHORD_TYPES = {
+        # Basic triads
+        'major': [0, 4, 7],
+        'minor': [0, 3, 7],
+        'dim': [0, 3, 6],
+        'aug': [0, 4, 8],
+        # Seventh chords
+        'maj7': [0, 4, 7, 11],
+        'min7': [0, 3, 7, 10],
+        'dom7': [0, 4, 7, 10],
+        'hdim7': [0, 3, 6, 10],
+        'dim7': [0, 3, 6, 9],
+        # Ninth chords
+        'maj9': [0, 4, 7, 11, 14],
+        'min9': [0, 3, 7, 10, 14],
+        'dom9': [0, 4, 7, 10, 14],
+        # Eleventh chords
+        'maj11': [0, 4, 7, 11, 14, 17],
+        'min11': [0, 3, 7, 10, 14, 17],
+        'dom11': [0, 4, 7, 10, 14, 17],
+        # Thirteenth chords
+        'maj13': [0, 4, 7, 11, 14, 17, 21],
+        'min13': [0, 3, 7, 10, 14, 17, 21],
+        'dom13': [0, 4, 7, 10, 14, 17, 21]
+    }
+
+    # Scale degree to chord quality for each extension level
+    CHORD_QUALITIES = {
+        'triad': {
+            0: 'major', 1: 'minor', 2: 'minor', 3: 'major',
+            4: 'major', 5: 'minor', 6: 'dim'
+        },
+        'seventh': {
+            0: 'maj7', 1: 'min7', 2: 'min7', 3: 'maj7',
+            4: 'dom7', 5: 'min7', 6: 'hdim7'
+        },
+        'ninth': {
+            0: 'maj9', 1: 'min9', 2: 'min9', 3: 'maj9',
+            4: 'dom9', 5: 'min9', 6: 'hdim7'
+        },
+        'eleventh': {
+            0: 'maj11', 1: 'min11', 2: 'min11', 3: 'maj11',
+            4: 'dom11', 5: 'min11', 6: 'hdim7'
+        },
+        'thirteenth': {
+            0: 'maj13', 1: 'min13', 2: 'min13', 3: 'maj13',
+            4: 'dom13', 5: 'min13', 6: 'hdim7'
+        }
+    }
+
+    QUALITY_MAP = {1: 'triad', 2: 'seventh', 3: 'ninth',
+                   4: 'eleventh', 5: 'thirteenth'}
+
+    # Inversion type that voices the whole progression for smooth voice leading
+    SMOOTH_INVERSION = 5
+
+    # Chord octaves offered to users, from low (1) to very high (4)
+    OCTAVE_CHOICES = range(1, 5)
+
+    # How melody notes are picked: independently at random, or from a note
+    # model trained on the MIDI files next to this script
+    NOTE_MODELS = ["uniform", "markov"]
+    MELODY_CORPUS_DIR = os.path.dirname(os.path.abspath(__file__))
+    MODEL_CACHE_DIR = os.path.join(MELODY_CORPUS_DIR, 'model_cache')
+
     def __init__(self):
         pygame.init()
         pygame.mixer.init()
+        self.segment_cache = SegmentCache()
+        self.strum_patterns = strum.compile_patterns(self.STRUM_PATTERNS)
+        self.voice_leader = VoiceLeader()
+        self.melody_model = None
 
     def clear_screen(self):
         os.system('cls' if os.name == 'nt' else 'clear')
@@ -144,58 +223,6 @@ class MelodyGenerator:
             return int(ticks * (1 + swing_amount))
         return ticks
 
-    def get_strum_speed(self, pattern_name):
-        """Get strum speed from pattern name"""
-        if pattern_name == "none":
-            return 0
-        if "alt_" in pattern_name:
-            # For alternating patterns, use the first speed (down stroke speed)
-            _, down_speed, _ = pattern_name.split("_")
-            return self.STRUM_PATTERNS[f"down_{down_speed}"]["speed"]
-        return self.STRUM_PATTERNS[pattern_name]["speed"]
-
-    def apply_strum(self, notes, velocities, strum_pattern, is_note_on=True, base_time=0):
-        """Apply strumming pattern to a chord"""
-        if strum_pattern == "none":
-            # All notes start together with the base_time
-            return [(note, vel, base_time if idx == 0 else 0) 
-                   for idx, (note, vel) in enumerate(zip(notes, velocities))]
-        
-        # Create a copy of notes and velocities to avoid modifying originals
-        notes = list(notes)
-        velocities = list(velocities)
-        
-        # For alternating patterns, extract speeds from pattern name
-        if "alt_" in strum_pattern:
-            _, down_speed, up_speed = strum_pattern.split("_")
-            if is_note_on:
-                speed = self.STRUM_PATTERNS[f"down_{down_speed}"]["speed"]
-                direction = "down"
-            else:
-                speed = self.STRUM_PATTERNS[f"up_{up_speed}"]["speed"]
-                direction = "up"
-        else:
-            direction = self.STRUM_PATTERNS[strum_pattern]["direction"]
-            speed = self.STRUM_PATTERNS[strum_pattern]["speed"]
-        
-        # Determine note order based on strum direction
-        if direction == "up":
-            notes.reverse()
-            velocities.reverse()
-        
-        # Calculate timing for each note in the strum
-        result = []
-        for idx, (note, vel) in enumerate(zip(notes, velocities)):
-            if idx == 0:
-                # First note gets the base timing
-                time = base_time
-            else:
-                # Subsequent notes are spaced by the speed
-                time = speed
-            result.append((note, vel, time))
-        
-        return result
-
     def get_strum_pattern(self, prompt):
         """Get strum pattern using numbered menu"""
         print("\nStrum Patterns:")
@@ -497,8 +524,7 @@ class MelodyGenerator:
         print("2. Medium (3)")
         print("3. High (4)")
         print("4. Very High (5)")
-        octave_choice = self.get_valid_input("Select octave (1-4): ", range(1, 5), int)
-        octave_offset = (octave_choice + 1) * 12  # Map to actual octave numbers
+        octave_choice = self.get_valid_input("Select octave (1-4): ", self.OCTAVE_CHOICES, int)
         
         # Add timing mode selection
         print("\nTiming Mode:")
@@ -541,150 +567,29 @@ class MelodyGenerator:
         track.append(Message('control_change', control=93, value=0, time=0))   # Chorus off
 
         # Adjust root note for selected octave (fixed to stay in same octave)
-        root_midi = self.NOTE_TO_MIDI[root_note] + octave_offset - 36  # Normalize to the selected octave
-
-        # Define chord types with extensions
-        chord_types = {
-            # Basic triads
-            'major': [0, 4, 7],
-            'minor': [0, 3, 7],
-            'dim': [0, 3, 6],
-            'aug': [0, 4, 8],
-            # Seventh chords
-            'maj7': [0, 4, 7, 11],
-            'min7': [0, 3, 7, 10],
-            'dom7': [0, 4, 7, 10],
-            'hdim7': [0, 3, 6, 10],
-            'dim7': [0, 3, 6, 9],
-            # Ninth chords
-            'maj9': [0, 4, 7, 11, 14],
-            'min9': [0, 3, 7, 10, 14],
-            'dom9': [0, 4, 7, 10, 14],
-            # Eleventh chords
-            'maj11': [0, 4, 7, 11, 14, 17],
-            'min11': [0, 3, 7, 10, 14, 17],
-            'dom11': [0, 4, 7, 10, 14, 17],
-            # Thirteenth chords
-            'maj13': [0, 4, 7, 11, 14, 17, 21],
-            'min13': [0, 3, 7, 10, 14, 17, 21],
-            'dom13': [0, 4, 7, 10, 14, 17, 21]
-        }
-
-        # Map scale degrees to chord qualities based on extension level
-        chord_qualities = {
-            'triad': {
-                0: 'major', 1: 'minor', 2: 'minor', 3: 'major',
-                4: 'major', 5: 'minor', 6: 'dim'
-            },
-            'seventh': {
-                0: 'maj7', 1: 'min7', 2: 'min7', 3: 'maj7',
-                4: 'dom7', 5: 'min7', 6: 'hdim7'
-            },
-            'ninth': {
-                0: 'maj9', 1: 'min9', 2: 'min9', 3: 'maj9',
-                4: 'dom9', 5: 'min9', 6: 'hdim7'
-            },
-            'eleventh': {
-                0: 'maj11', 1: 'min11', 2: 'min11', 3: 'maj11',
-                4: 'dom11', 5: 'min11', 6: 'hdim7'
-            },
-            'thirteenth': {
-                0: 'maj13', 1: 'min13', 2: 'min13', 3: 'maj13',
-                4: 'dom13', 5: 'min13', 6: 'hdim7'
-            }
-        }
-
-        # Map chord choice to quality dict
-        quality_map = {1: 'triad', 2: 'seventh', 3: 'ninth', 
-                      4: 'eleventh', 5: 'thirteenth'}
-        quality_dict = quality_map[chord_choice]
+        root_midi = self.chord_root_midi(root_note, octave_choice)
 
-        # Calculate timing values
+        # Strum speeds scale with the file's resolution
         ticks_per_beat = mid.ticks_per_beat
-        strum_speeds = {
+        strum_patterns = strum.compile_patterns(self.STRUM_PATTERNS, speeds={
             'slow': ticks_per_beat // 8,
             'med': ticks_per_beat // 16,
             'fast': ticks_per_beat // 32
-        }
-
-        # Update strum speeds based on BPM
-        for pattern_name, pattern in self.STRUM_PATTERNS.items():
-            if 'slow' in pattern_name:
-                pattern['speed'] = strum_speeds['slow']
-            elif 'med' in pattern_name:
-                pattern['speed'] = strum_speeds['med']
-            elif 'fast' in pattern_name:
-                pattern['speed'] = strum_speeds['fast']
-
-        def apply_inversion(notes, inv_type):
-            """Apply chord inversion to a set of notes"""
-            if inv_type == 0 or not notes:  # Root position or empty chord
-                return notes
-            if inv_type == 4:  # Random inversion
-                inv_type = random.randint(0, min(3, len(notes) - 1))
-            # Rotate notes for inversion
-            inv_type = min(inv_type, len(notes) - 1)
-            return notes[inv_type:] + [n + 12 for n in notes[:inv_type]]
-
-        # Generate chord progression with precise timing
-        for rep in range(repetitions):
-            for i, chord_root in enumerate(progression):
-                chord_type = chord_qualities[quality_dict][chord_root]
-                chord_intervals = chord_types[chord_type]
-                
-                # Build chord notes with inversion
-                chord_notes = [root_midi + chord_root + interval for interval in chord_intervals]
-                chord_notes = apply_inversion(chord_notes, inversion)
-                
-                # Base velocity with slight random variation
-                base_velocity = random.randint(64, 100)
-                velocities = [max(40, base_velocity + random.randint(-5, 5)) for _ in range(len(chord_notes))]
-                
-                # Calculate strum timing
-                strum_duration = 0
-                if strum_in != 'none':
-                    strum_duration = len(chord_notes) * self.get_strum_speed(strum_in)
-                
-                # Apply strum pattern for note-on events
-                strum_on = self.apply_strum(chord_notes, velocities, strum_in, True, 0)
-                
-                # Add note-on events with timing based on selected mode
-                if timing_mode == 1:  # Regular mode
-                    for j, (note, velocity, time) in enumerate(strum_on):
-                        if j == 0:
-                            # First note of each chord
-                            track.append(Message('note_on', note=note, velocity=velocity, 
-                                              time=ticks_per_beat if (i > 0 or rep > 0) else 0))
-                        else:
-                            # Subsequent notes in the chord
-                            track.append(Message('note_on', note=note, velocity=velocity, time=time))
-                else:  # Tight mode
-                    for j, (note, velocity, time) in enumerate(strum_on):
-                        if i == 0 and j == 0 and rep == 0:
-                            # Very first note of progression
-                            track.append(Message('note_on', note=note, velocity=velocity, time=0))
-                        else:
-                            # All other notes - maintain tight timing
-                            track.append(Message('note_on', note=note, velocity=velocity, time=time))
-                
-                # Calculate remaining time for the chord duration
-                if timing_mode == 1:  # Regular mode
-                    if rep < repetitions - 1 or (rep == repetitions - 1 and i < len(progression) - 1):
-                        remaining_time = ticks_per_beat - strum_duration
-                    else:
-                        remaining_time = ticks_per_beat
-                else:  # Tight mode
-                    remaining_time = max(1, ticks_per_beat - strum_duration)  # Ensure at least 1 tick
-                
-                # Apply strum pattern for note-off events
-                strum_off = self.apply_strum(chord_notes, velocities, strum_out, False, remaining_time)
-                
-                # Add note-off events
-                for j, (note, _, time) in enumerate(strum_off):
-                    if timing_mode == 2 and j == len(strum_off) - 1 and (rep < repetitions - 1 or (rep == repetitions - 1 and i < len(progression) - 1)):
-                        # In tight mode, ensure last note-off connects to next chord
-                        time = max(1, time)  # Ensure at least 1 tick between chords
-                    track.append(Message('note_off', note=note, velocity=0, time=time))
+        })
+
+        # Build every chord, then time the whole progression in one pass
+        chords = []
+        velocities = []
+        for chord_root in progression * repetitions:
+            chord_notes, chord_velocities = self.voice_chord(root_midi, chord_root, chord_choice, inversion)
+            chords.append(chord_notes)
+            velocities.append(chord_velocities)
+
+        events = strum.chord_progression_arrays(chords, velocities, ticks_per_beat, timing_mode,
+                                                strum_patterns[strum_in], strum_patterns[strum_out])
+        for time, status, note, velocity in zip(*(column.tolist() for column in events)):
+            msg_type = 'note_on' if status == strum.NOTE_ON else 'note_off'
+            track.append(Message(msg_type, note=note, velocity=velocity, time=time))
 
         # If there are remaining bars, add them
         if remaining_bars > 0:
@@ -708,146 +613,345 @@ class MelodyGenerator:
         print(f"\n✨ Chord progression generated and saved as: {filename}")
         input("\nPress Enter to return to menu...")
 
-    def generate_melody_web(self, output_file, root_note, mode, rhythm_pattern, bpm, bars,
-                          use_swing=False, swing_type='medium', use_humanization=False,
-                          humanization_amount=0.2):
-        """Web version of melody generation that saves to a specific file"""
-        # Create MIDI file
-        mid = MidiFile()
-        track = MidiTrack()
-        mid.tracks.append(track)
-
-        # Setup track
-        track.append(Message('program_change', program=0, time=0))
-        track.append(Message('control_change', control=7, value=100, time=0))
-        track.append(Message('control_change', control=10, value=64, time=0))
+    def parse_progression(self, progression_type):
+        """Resolve a preset name or a hyphen-separated custom progression"""
+        if progression_type in self.CHORD_PROGRESSIONS:
+            return self.CHORD_PROGRESSIONS[progression_type]
+        # Handle custom or random progression
+        try:
+            progression = [int(n) for n in progression_type.split('-')]
+        except ValueError:
+            raise ValueError(f"Unknown progression: {progression_type}") from None
+        if not all(0 <= n <= 6 for n in progression):
+            raise ValueError("Progression degrees must be between 0 and 6")
+        return progression
+
+    def apply_inversion(self, notes, inv_type):
+        """Apply chord inversion to a set of notes"""
+        if inv_type == 0 or not notes:  # Root position or empty chord
+            return notes
+        if inv_type == 4:  # Random inversion
+            inv_type = random.randint(0, min(3, len(notes) - 1))
+        # Rotate notes for inversion
+        inv_type = min(inv_type, len(notes) - 1)
+        return notes[inv_type:] + [n + 12 for n in notes[:inv_type]]
+
+    def load_melody_model(self):
+        """Train the markov note model, or load its compiled tables from the cache"""
+        if self.melody_model is None:
+            corpus = glob.glob(os.path.join(self.MELODY_CORPUS_DIR, '*.mid'))
+            self.melody_model = MelodyModel.load(corpus, self.SCALE_MODES,
+                                                 cache_dir=self.MODEL_CACHE_DIR)
+        return self.melody_model
+
+    def preload_tables(self, octave_choices=OCTAVE_CHOICES):
+        """Build the note model and every chord's voicing candidates and transitions ahead of use"""
+        self.load_melody_model()
+        for root_note in self.NOTE_TO_MIDI:
+            for octave_choice in octave_choices:
+                root_midi = self.chord_root_midi(root_note, octave_choice)
+                for chord_type in self.QUALITY_MAP:
+                    chords = [self.root_position(root_midi, chord_root, chord_type)
+                              for chord_root in range(7)]
+                    for chord in chords:
+                        self.voice_leader.candidates(chord)
+                    # Transitions depend only on the chords' shapes and root
+                    # interval, so one key and octave covers all of them
+                    if root_note == 'C' and octave_choice == octave_choices[0]:
+                        for previous in chords:
+                            for current in chords:
+                                self.voice_leader.transition(previous, current)
+
+    def sample_melodies(self, root_note, mode, count, length):
+        """Sample count markov melodies of length notes at once as MIDI note numbers"""
+        rng = np.random.default_rng(random.getrandbits(64))
+        positions = self.load_melody_model().sample(mode, count, length, rng)
+        return self.NOTE_TO_MIDI[root_note] + scale_offsets(self.SCALE_MODES[mode])[positions]
+
+    def rhythm_ticks(self, rhythm_pattern, use_swing=False, swing_type='medium'):
+        """Length in ticks of each note of a melody bar before humanization"""
+        swing_amount = self.SWING_AMOUNTS[swing_type] if use_swing else 0
+        ticks = []
+        for i, (duration, _) in enumerate(self.RHYTHM_PATTERNS[rhythm_pattern]):
+            note_ticks = int(self.TICKS_PER_BEAT * duration)
+            if use_swing:
+                note_ticks = self.apply_swing(note_ticks, i % 2 == 1, swing_amount)
+            ticks.append(note_ticks)
+        return ticks
 
+    def melody_bar_events(self, root_note, mode, rhythm_pattern, bars,
+                          use_swing=False, swing_type='medium', use_humanization=False,
+                          humanization_amount=0.2, note_model='uniform'):
+        """Yield the note events of a melody one bar at a time"""
         # Calculate scale notes
         root_midi = self.NOTE_TO_MIDI[root_note]
         scale_intervals = self.SCALE_MODES[mode]
         scale_notes = [root_midi + interval for interval in scale_intervals]
         scale_notes.extend([note + 12 for note in scale_notes])
 
-        # Get swing amount if enabled
-        swing_amount = self.SWING_AMOUNTS[swing_type] if use_swing else 0
-
-        # Generate melody
-        ticks_per_beat = mid.ticks_per_beat
         pattern = self.RHYTHM_PATTERNS[rhythm_pattern]
+        # Note lengths with swing applied
+        bar_ticks = self.rhythm_ticks(rhythm_pattern, use_swing, swing_type)
+
+        # The markov model draws the whole line up front
+        if note_model == 'markov':
+            model_notes = iter(self.sample_melodies(root_note, mode, 1, bars * len(pattern))[0].tolist())
+        elif note_model == 'uniform':
+            model_notes = None
+        else:
+            raise ValueError(f"Unknown note model: {note_model}")
 
         for bar in range(bars):
-            for i, (duration, velocity) in enumerate(pattern):
-                note = random.choice(scale_notes)
-                ticks = int(ticks_per_beat * duration)
+            events = []
+            for i, (_, velocity) in enumerate(pattern):
+                note = random.choice(scale_notes) if model_notes is None else next(model_notes)
+                ticks = bar_ticks[i]
                 velocity_val = int(velocity * 64)
 
-                # Apply swing if enabled
-                if use_swing:
-                    ticks = self.apply_swing(ticks, i % 2 == 1, swing_amount)
-
                 # Apply humanization if enabled
                 if use_humanization:
                     ticks = self.apply_microshift(ticks, humanization_amount)
                     velocity_val = self.apply_microshift(velocity_val, humanization_amount/2)
 
-                track.append(Message('note_on', note=note, velocity=velocity_val, time=0))
-                track.append(Message('note_off', note=note, velocity=velocity_val, time=ticks))
+                # Keep humanized velocities a valid, audible MIDI data byte
+                velocity_val = max(1, min(127, velocity_val))
+
+                events.append(('note_on', note, velocity_val, 0))
+                events.append(('note_off', note, velocity_val, ticks))
+            yield events
+
+    def chord_root_midi(self, root_note, octave_choice):
+        """MIDI note of the key's root in the selected octave"""
+        if octave_choice not in self.OCTAVE_CHOICES:
+            raise ValueError(f"Octave must be between {self.OCTAVE_CHOICES[0]} and "
+                             f"{self.OCTAVE_CHOICES[-1]}")
+        return self.NOTE_TO_MIDI[root_note] + (octave_choice + 1) * 12 - 36
+
+    def root_position(self, root_midi, chord_root, chord_type):
+        """Notes of the chord on one scale degree in root position"""
+        quality = self.CHORD_QUALITIES[self.QUALITY_MAP[chord_type]][chord_root]
+        return [root_midi + chord_root + interval for interval in self.CHORD_TYPES[quality]]
+
+    def smooth_voicings(self, root_midi, chord_roots, chord_type, before=None, after=None):
+        """Voice a sequence of scale degrees with minimal movement between chords"""
+        chords = [self.root_position(root_midi, chord_root, chord_type) for chord_root in chord_roots]
+        return self.voice_leader.solve(chords, before, after)
+
+    def voice_chord(self, root_midi, chord_root, chord_type, inversion, voicing=None):
+        """Build the notes and velocities for the chord on one scale degree"""
+        # Build chord notes with inversion unless a voicing was chosen already
+        if voicing is None:
+            chord_notes = self.root_position(root_midi, chord_root, chord_type)
+            chord_notes = self.apply_inversion(chord_notes, inversion)
+        else:
+            chord_notes = list(voicing)
 
-        # Save to specified file
-        mid.save(output_file)
+        # Base velocity with slight random variation
+        base_velocity = random.randint(64, 100)
+        velocities = [max(40, base_velocity + random.randint(-5, 5))
+                    for _ in range(len(chord_notes))]
+        return chord_notes, velocities
 
-    def generate_chord_progression_web(self, output_file, root_note, progression_type, bpm,
-                                    total_bars, octave_choice, timing_mode, chord_type,
-                                    inversion, strum_in, strum_out):
-        """Web version of chord progression generation that saves to a specific file"""
-        # Get progression
-        if progression_type in self.CHORD_PROGRESSIONS:
-            progression = self.CHORD_PROGRESSIONS[progression_type]
-        else:
-            # Handle custom or random progression
-            progression = [int(n) for n in progression_type.split('-')]
+    def chord_voicings(self, root_note, progression_type, total_bars, octave_choice,
+                       chord_type, inversion):
+        """Yield (degree, notes, velocities, is_first, is_last) for each chord of a progression"""
+        progression = self.parse_progression(progression_type)
 
         # Calculate repetitions
         repetitions = max(1, total_bars // len(progression))
-        remaining_bars = total_bars % len(progression)
+        sequence = progression * repetitions
 
-        mid = MidiFile(type=0)  # Type 0 for better timing
-        track = MidiTrack()
-        mid.tracks.append(track)
+        # Adjust root note for selected octave
+        root_midi = self.chord_root_midi(root_note, octave_choice)
+
+        # Smooth voice leading picks every voicing up front
+        voicings = None
+        if inversion == self.SMOOTH_INVERSION:
+            voicings = self.smooth_voicings(root_midi, sequence, chord_type)
+
+        for index, chord_root in enumerate(sequence):
+            is_first = index == 0
+            is_last = index == len(sequence) - 1
+            chord_notes, velocities = self.voice_chord(root_midi, chord_root, chord_type, inversion,
+                                                       voicings[index] if voicings else None)
+            yield chord_root, chord_notes, velocities, is_first, is_last
+
+    def chord_events(self, chord_notes, velocities, timing_mode, strum_in, strum_out,
+                     is_first, is_last):
+        """Build the note events for a single chord of a progression"""
+        delta, status, note, velocity = strum.chord_progression_arrays(
+            [chord_notes], [velocities], self.TICKS_PER_BEAT, timing_mode,
+            self.strum_patterns[strum_in], self.strum_patterns[strum_out], is_first, is_last)
+        return [('note_on' if s == strum.NOTE_ON else 'note_off', n, v, t)
+                for t, s, n, v in zip(delta.tolist(), status.tolist(), note.tolist(), velocity.tolist())]
+
+    def chord_progression_arrays(self, root_note, progression_type, total_bars, octave_choice,
+                                 timing_mode, chord_type, inversion, strum_in, strum_out):
+        """Note events of a whole chord progression as (delta, status, note, velocity) arrays"""
+        chords = []
+        velocities = []
+        for _, chord_notes, chord_velocities, _, _ in self.chord_voicings(
+                root_note, progression_type, total_bars, octave_choice, chord_type, inversion):
+            chords.append(chord_notes)
+            velocities.append(chord_velocities)
+        return strum.chord_progression_arrays(chords, velocities, self.TICKS_PER_BEAT, timing_mode,
+                                              self.strum_patterns[strum_in],
+                                              self.strum_patterns[strum_out])
+
+    def check_chord_params(self, root_note, progression_type, bpm, total_bars, octave_choice,
+                           timing_mode, chord_type, inversion, strum_in, strum_out):
+        """Raise ValueError for chord progression settings that would fail part way through"""
+        if root_note not in self.NOTE_TO_MIDI:
+            raise ValueError(f"Unknown root note: {root_note}")
+        if bpm <= 0:
+            raise ValueError("BPM must be positive")
+        self.parse_progression(progression_type)
+        self.chord_root_midi(root_note, octave_choice)
+        if timing_mode not in (1, 2):
+            raise ValueError("Timing mode must be 1 (regular) or 2 (tight)")
+        if chord_type not in self.QUALITY_MAP:
+            raise ValueError(f"Chord type must be between {min(self.QUALITY_MAP)} and "
+                             f"{max(self.QUALITY_MAP)}")
+        if not 0 <= inversion <= self.SMOOTH_INVERSION:
+            raise ValueError(f"Inversion must be between 0 and {self.SMOOTH_INVERSION}")
+        for strum_name in (strum_in, strum_out):
+            if strum_name not in self.strum_patterns:
+                raise ValueError(f"Unknown strum pattern: {strum_name}")
+
+    def chord_progression_bar_events(self, root_note, progression_type, total_bars,
+                                     octave_choice, timing_mode, chord_type, inversion,
+                                     strum_in, strum_out):
+        """Yield the note events of a chord progression one chord at a time"""
+        for _, chord_notes, velocities, is_first, is_last in self.chord_voicings(
+                root_note, progression_type, total_bars, octave_choice, chord_type, inversion):
+            yield self.chord_events(chord_notes, velocities, timing_mode, strum_in, strum_out,
+                                    is_first, is_last)
+
+    def encode_chord(self, chord_notes, velocities, timing_mode, strum_in, strum_out,
+                     is_first, is_last):
+        """Encode one chord, reusing the cached bytes of an identical voicing"""
+        # Repeated chords only differ in their velocities, which are
+        # patched into the copy of the cached segment
+        key = (tuple(chord_notes), timing_mode, strum_in, strum_out, is_first, is_last)
+        segment = self.segment_cache.get(key, lambda: self.chord_events(
+            chord_notes, range(len(chord_notes)), timing_mode, strum_in, strum_out,
+            is_first, is_last))
+        data = bytearray()
+        segment.render_into(data, velocities)
+        return bytes(data)
+
+    def build_melody(self, root_note, mode, rhythm_pattern, bpm, bars,
+                     use_swing=False, swing_type='medium', use_humanization=False,
+                     humanization_amount=0.2, note_model='uniform'):
+        """Generate a melody as a Generation of individually encoded bars"""
+        params = {
+            'root_note': root_note, 'mode': mode, 'rhythm_pattern': rhythm_pattern,
+            'bpm': bpm, 'bars': bars, 'use_swing': use_swing, 'swing_type': swing_type,
+            'use_humanization': use_humanization, 'humanization_amount': humanization_amount,
+            'note_model': note_model
+        }
 
         # Setup track
-        track.append(MetaMessage('set_tempo', tempo=bpm2tempo(bpm), time=0))
-        track.append(Message('program_change', program=0, time=0))
-        track.append(Message('control_change', control=7, value=100, time=0))
-        track.append(Message('control_change', control=10, value=64, time=0))
-        track.append(Message('control_change', control=91, value=0, time=0))
-        track.append(Message('control_change', control=93, value=0, time=0))
+        header = smf.program_change(0) + smf.control_changes([(7, 100), (10, 64)])
 
-        # Adjust root note for selected octave
-        root_midi = self.NOTE_TO_MIDI[root_note] + (octave_choice + 1) * 12 - 36
+        # Generate melody
+        bar_data = [bytes(smf.encode_events(events)[0])
+                    for events in self.melody_bar_events(root_note, mode, rhythm_pattern, bars,
+                                                         use_swing, swing_type, use_humanization,
+                                                         humanization_amount, note_model)]
+        return Generation('melody', params, header, bar_data, self.TICKS_PER_BEAT, midi_type=1)
+
+    def build_chord_progression(self, root_note, progression_type, bpm, total_bars,
+                                octave_choice, timing_mode, chord_type, inversion,
+                                strum_in, strum_out):
+        """Generate a chord progression as a Generation of individually encoded chords"""
+        params = {
+            'root_note': root_note, 'progression_type': progression_type, 'bpm': bpm,
+            'total_bars': total_bars, 'octave_choice': octave_choice,
+            'timing_mode': timing_mode, 'chord_type': chord_type, 'inversion': inversion,
+            'strum_in': strum_in, 'strum_out': strum_out
+        }
 
-        # Map chord choice to quality dict
-        quality_map = {1: 'triad', 2: 'seventh', 3: 'ninth', 
-                      4: 'eleventh', 5: 'thirteenth'}
-        quality_dict = quality_map[chord_type]
+        # Setup track
+        header = (smf.set_tempo(bpm2tempo(bpm)) + smf.program_change(0) +
+                  smf.control_changes([(7, 100), (10, 64), (91, 0), (93, 0)]))
 
         # Generate chord progression
-        for rep in range(repetitions):
-            for i, chord_root in enumerate(progression):
-                chord_type = self.chord_qualities[quality_dict][chord_root]
-                chord_intervals = self.chord_types[chord_type]
-                
-                # Build chord notes with inversion
-                chord_notes = [root_midi + chord_root + interval for interval in chord_intervals]
-                chord_notes = self.apply_inversion(chord_notes, inversion)
-                
-                # Base velocity with slight random variation
-                base_velocity = random.randint(64, 100)
-                velocities = [max(40, base_velocity + random.randint(-5, 5)) 
-                            for _ in range(len(chord_notes))]
-                
-                # Calculate strum timing
-                strum_duration = 0
-                if strum_in != 'none':
-                    strum_duration = len(chord_notes) * self.get_strum_speed(strum_in)
-                
-                # Apply strum patterns
-                strum_on = self.apply_strum(chord_notes, velocities, strum_in, True, 0)
-                
-                # Add note-on events
-                for j, (note, velocity, time) in enumerate(strum_on):
-                    if timing_mode == 1:  # Regular mode
-                        if j == 0:
-                            track.append(Message('note_on', note=note, velocity=velocity, 
-                                              time=mid.ticks_per_beat if (i > 0 or rep > 0) else 0))
-                        else:
-                            track.append(Message('note_on', note=note, velocity=velocity, time=time))
-                    else:  # Tight mode
-                        if i == 0 and j == 0 and rep == 0:
-                            track.append(Message('note_on', note=note, velocity=velocity, time=0))
-                        else:
-                            track.append(Message('note_on', note=note, velocity=velocity, time=time))
-                
-                # Calculate remaining time
-                if timing_mode == 1:
-                    remaining_time = (mid.ticks_per_beat - strum_duration 
-                                   if rep < repetitions - 1 or 
-                                   (rep == repetitions - 1 and i < len(progression) - 1)
-                                   else mid.ticks_per_beat)
-                else:
-                    remaining_time = max(1, mid.ticks_per_beat - strum_duration)
-                
-                # Apply strum pattern for note-off events
-                strum_off = self.apply_strum(chord_notes, velocities, strum_out, False, remaining_time)
-                
-                # Add note-off events
-                for j, (note, _, time) in enumerate(strum_off):
-                    if timing_mode == 2 and j == len(strum_off) - 1 and (rep < repetitions - 1 or (rep == repetitions - 1 and i < len(progression) - 1)):
-                        time = max(1, time)
-                    track.append(Message('note_off', note=note, velocity=0, time=time))
-
-        # Save to specified file
-        mid.save(output_file)
+        bar_data = []
+        chords = []
+        voicings = []
+        for chord_root, chord_notes, velocities, is_first, is_last in self.chord_voicings(
+                root_note, progression_type, total_bars, octave_choice, chord_type, inversion):
+            bar_data.append(self.encode_chord(chord_notes, velocities, timing_mode,
+                                              strum_in, strum_out, is_first, is_last))
+            chords.append(chord_root)
+            voicings.append(tuple(chord_notes))
+
+        # Type 0 for better timing
+        return Generation('chords', params, header, bar_data, self.TICKS_PER_BEAT,
+                          midi_type=0, chords=chords, voicings=voicings)
+
+    def regenerate_bars(self, generation, start, end, chords=None):
+        """Re-roll bars start..end-1 of a generation, optionally with new chords
+
+        Only the edited bars are generated and encoded again; every other bar
+        is kept byte for byte.
+        """
+        if not 0 <= start < end <= len(generation.bars):
+            raise ValueError(f"Bar range must be within 0-{len(generation.bars)}")
+        if chords is not None and len(chords) != end - start:
+            raise ValueError("Provide one chord per edited bar")
+        params = generation.params
+
+        if generation.kind == 'melody':
+            bar_events = self.melody_bar_events(params['root_note'], params['mode'],
+                                                params['rhythm_pattern'], end - start,
+                                                params['use_swing'], params['swing_type'],
+                                                params['use_humanization'],
+                                                params['humanization_amount'],
+                                                params['note_model'])
+            return generation.splice(start, [bytes(smf.encode_events(events)[0])
+                                             for events in bar_events])
+
+        root_midi = self.chord_root_midi(params['root_note'], params['octave_choice'])
+        if chords is None:
+            chords = generation.chords[start:end]
+
+        # Re-voice only the edited chords, leading smoothly from and into
+        # the untouched neighbours
+        smooth = None
+        if params['inversion'] == self.SMOOTH_INVERSION:
+            before = generation.voicings[start - 1] if start > 0 else None
+            after = generation.voicings[end] if end < len(generation.bars) else None
+            smooth = self.smooth_voicings(root_midi, chords, params['chord_type'], before, after)
+
+        bar_data = []
+        voicings = []
+        for offset, chord_root in enumerate(chords):
+            index = start + offset
+            chord_notes, velocities = self.voice_chord(root_midi, chord_root,
+                                                       params['chord_type'], params['inversion'],
+                                                       smooth[offset] if smooth else None)
+            bar_data.append(self.encode_chord(chord_notes, velocities, params['timing_mode'],
+                                              params['strum_in'], params['strum_out'],
+                                              index == 0, index == len(generation.bars) - 1))
+            voicings.append(tuple(chord_notes))
+        return generation.splice(start, bar_data, list(chords), voicings)
+
+    def generate_melody_web(self, output_file, root_note, mode, rhythm_pattern, bpm, bars,
+                          use_swing=False, swing_type='medium', use_humanization=False,
+                          humanization_amount=0.2, note_model='uniform'):
+        """Web version of melody generation that saves to a specific file"""
+        self.build_melody(root_note, mode, rhythm_pattern, bpm, bars, use_swing, swing_type,
+                          use_humanization, humanization_amount, note_model).save(output_file)
+
+    def generate_chord_progression_web(self, output_file, root_note, progression_type, bpm,
+                                    total_bars, octave_choice, timing_mode, chord_type,
+                                    inversion, strum_in, strum_out):
+        """Web version of chord progression generation that saves to a specific file"""
+        self.build_chord_progression(root_note, progression_type, bpm, total_bars,
+                                     octave_choice, timing_mode, chord_type, inversion,
+                                     strum_in, strum_out).save(output_file)
 
 
 if __name__ == "__main__":
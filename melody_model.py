@@ -0,0 +1,132 @@
+import hashlib
+import os
+import numpy as np
+import smf_reader
+
+
+# Melodic intervals beyond two octaves either way are clipped to it
+MAX_INTERVAL = 24
+INTERVALS = 2 * MAX_INTERVAL + 1
+
+
+def scale_offsets(scale_intervals):
+    """Semitone offsets of the two-octave scale melodies are drawn from"""
+    return np.array(list(scale_intervals) + [i + 12 for i in scale_intervals], dtype=np.int64)
+
+
+def melody_line(track):
+    """Pitch sequence of a track, keeping the highest note of simultaneous onsets"""
+    is_on = ((track.status & 0xF0) == 0x90) & (track.velocity > 0)
+    times = np.cumsum(track.delta)[is_on]
+    pitches = track.note[is_on].astype(np.int64)
+    order = np.lexsort((-pitches, times))
+    times, pitches = times[order], pitches[order]
+    return pitches[np.r_[True, times[1:] != times[:-1]]]
+
+
+def count_intervals(lines, order):
+    """Count interval n-grams of every length up to order in dense arrays"""
+    counts = [None] + [np.zeros((INTERVALS,) * k, dtype=np.float64) for k in range(1, order + 1)]
+    for pitches in lines:
+        intervals = np.clip(np.diff(pitches), -MAX_INTERVAL, MAX_INTERVAL) + MAX_INTERVAL
+        for k in range(1, order + 1):
+            if len(intervals) < k:
+                break
+            windows = np.lib.stride_tricks.sliding_window_view(intervals, k)
+            np.add.at(counts[k], tuple(windows.T), 1)
+    return counts
+
+
+def compile_table(counts, offsets, order, smoothing):
+    """Cumulative next-note probabilities for every state of one scale
+
+    A state is the scale index of the last order notes. Each order of
+    interval n-gram counts is interpolated with the next lower one, down to
+    a uniform choice, so unseen intervals keep a small probability.
+    """
+    size = len(offsets)
+    states = np.indices((size,) * order).reshape(order, -1).T
+    sequences = np.concatenate([
+        np.repeat(states[:, None, :], size, axis=1),
+        np.broadcast_to(np.arange(size)[None, :, None], (len(states), size, 1))
+    ], axis=2)
+    intervals = np.clip(np.diff(offsets[sequences], axis=2), -MAX_INTERVAL, MAX_INTERVAL) + MAX_INTERVAL
+
+    probabilities = np.full((len(states), size), 1 / size)
+    for k in range(1, order + 1):
+        observed = counts[k][tuple(np.moveaxis(intervals[:, :, -k:], 2, 0))]
+        probabilities = observed + smoothing * probabilities
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+
+    cdf = np.cumsum(probabilities, axis=1)
+    cdf[:, -1] = 1.0
+    return cdf
+
+
+class MelodyModel:
+    """Interval n-gram melody model compiled into cumulative tables per scale mode
+
+    Tables are indexed by the scale positions of the last order notes, so a
+    model compiled for a mode serves every root note.
+    """
+
+    def __init__(self, tables, order):
+        self.tables = tables
+        self.order = order
+
+    @classmethod
+    def load(cls, corpus, scale_modes, order=2, smoothing=1.0, cache_dir=None):
+        """Train on the MIDI files under corpus, reusing compiled tables from cache_dir"""
+        files = sorted(smf_reader.find_files(corpus))
+        fingerprint = hashlib.sha256(repr((order, smoothing, sorted(scale_modes.items()))).encode())
+        for path in files:
+            stat = os.stat(path)
+            fingerprint.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+        cache_file = None
+        if cache_dir:
+            cache_file = os.path.join(cache_dir, f"melody_model_{fingerprint.hexdigest()[:16]}.npz")
+            if os.path.exists(cache_file):
+                with np.load(cache_file) as cached:
+                    return cls({mode: cached[mode] for mode in cached.files}, order)
+
+        lines = []
+        for path in files:
+            try:
+                lines.append(melody_line(smf_reader.read_file(path)))
+            except ValueError:
+                continue  # Not in the subset we can read
+        counts = count_intervals(lines, order)
+        tables = {mode: compile_table(counts, scale_offsets(intervals), order, smoothing)
+                  for mode, intervals in scale_modes.items()}
+
+        if cache_file:
+            os.makedirs(cache_dir, exist_ok=True)
+            partial_file = f"{cache_file}.{os.getpid()}.tmp"
+            with open(partial_file, 'wb') as f:
+                np.savez(f, **tables)
+            os.replace(partial_file, cache_file)
+        return cls(tables, order)
+
+    def sample(self, mode, count, length, rng=None):
+        """Sample count melodies of length notes as scale positions, all at once
+
+        Every step draws one uniform number per melody and finds the next
+        note in its state's cumulative row.
+        """
+        rng = rng if rng is not None else np.random.default_rng()
+        cdf = self.tables[mode]
+        size = cdf.shape[1]
+        melodies = np.empty((count, length), dtype=np.int64)
+
+        # The first notes have no history and are chosen uniformly
+        start = min(self.order, length)
+        melodies[:, :start] = rng.integers(size, size=(count, start))
+        state = np.zeros(count, dtype=np.int64)
+        for t in range(start):
+            state = state * size + melodies[:, t]
+
+        draws = rng.random((count, length))
+        for t in range(start, length):
+            melodies[:, t] = (cdf[state] < draws[:, t, None]).sum(axis=1)
+            state = (state * size + melodies[:, t]) % len(cdf)
+        return melodies
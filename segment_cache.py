@@ -0,0 +1,55 @@
+import threading
+from collections import OrderedDict
+import smf
+
+
+class Segment:
+    """Encoded events for one chord with the velocity bytes left open"""
+
+    __slots__ = ('data', 'velocity_slots')
+
+    def __init__(self, events):
+        # Note-on events carry an index into the chord's velocity list in
+        # place of a velocity; note-offs always use velocity 0
+        data, offsets = smf.encode_events(
+            (msg_type, note, 0, time) for msg_type, note, _, time in events)
+        self.data = bytes(data)
+        self.velocity_slots = [(offset, event[2]) for offset, event in zip(offsets, events)
+                               if event[0] == 'note_on']
+
+    def render_into(self, track_data, velocities):
+        """Append the segment to a track and patch its velocities in place"""
+        start = len(track_data)
+        track_data += self.data
+        for offset, index in self.velocity_slots:
+            velocity = velocities[index]
+            if not 0 <= velocity <= 127:
+                raise ValueError(f"data byte must be in range 0..127 (velocity {velocity})")
+            track_data[start + offset] = velocity
+
+
+class SegmentCache:
+    """LRU cache of encoded chord segments shared across requests"""
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._segments = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, build_events):
+        """Return the segment for key, encoding build_events() on a miss"""
+        with self._lock:
+            segment = self._segments.get(key)
+            if segment is not None:
+                self._segments.move_to_end(key)
+                return segment
+
+        segment = Segment(build_events())
+        with self._lock:
+            self._segments[key] = segment
+            if len(self._segments) > self.max_entries:
+                self._segments.popitem(last=False)
+        return segment
+
+    def __len__(self):
+        return len(self._segments)
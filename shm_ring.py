@@ -0,0 +1,110 @@
+import queue
+from multiprocessing import Queue
+from multiprocessing.shared_memory import SharedMemory
+
+
+class Result:
+    """A result taken from the ring; release it to hand its slot back"""
+
+    def __init__(self, ring, key, view=None, slot=None, error=None):
+        self.ring = ring
+        self.key = key
+        self.view = view
+        self.slot = slot
+        self.error = error
+
+    def release(self):
+        if isinstance(self.view, memoryview):
+            self.view.release()
+        if self.slot is not None:
+            self.ring._free.put(self.slot)
+            self.slot = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class ResultRing:
+    """Fixed-size shared memory slots for passing results from worker processes
+
+    A worker takes a free slot, writes its result straight into it and
+    announces the slot; only the key and length travel through a queue. The
+    parent reads the result through a memoryview of the slot and hands the
+    slot back when done. Workers block while every slot is in use, so a
+    slow consumer holds the producers back instead of piling up memory.
+    """
+
+    def __init__(self, slots=16, slot_size=1 << 20):
+        self.slots = slots
+        self.slot_size = slot_size
+        self._shm = SharedMemory(create=True, size=slots * slot_size)
+        self._owner = True
+        self._free = Queue()
+        self._ready = Queue()
+        for slot in range(slots):
+            self._free.put(slot)
+
+    def __getstate__(self):
+        # Worker processes attach to the same block by name
+        return {'slots': self.slots, 'slot_size': self.slot_size, 'name': self._shm.name,
+                'free': self._free, 'ready': self._ready}
+
+    def __setstate__(self, state):
+        self.slots = state['slots']
+        self.slot_size = state['slot_size']
+        self._shm = SharedMemory(name=state['name'])
+        self._owner = False
+        self._free = state['free']
+        self._ready = state['ready']
+
+    def put(self, key, write, size, timeout=None):
+        """Write a result of at most size bytes with write(buffer) -> length
+
+        Blocks until a slot is free, or raises TimeoutError after timeout
+        seconds. Results larger than a slot are sent through the queue.
+        """
+        if size > self.slot_size:
+            buffer = bytearray(size)
+            length = write(memoryview(buffer))
+            self._ready.put(('inline', key, bytes(buffer[:length])))
+            return
+        try:
+            slot = self._free.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("Result ring is full") from None
+        start = slot * self.slot_size
+        view = self._shm.buf[start:start + self.slot_size]
+        try:
+            length = write(view)
+        except BaseException:
+            self._free.put(slot)
+            raise
+        finally:
+            view.release()
+        self._ready.put(('slot', key, slot, length))
+
+    def put_error(self, key, message):
+        self._ready.put(('error', key, message))
+
+    def get(self, timeout=None):
+        """Take the next result, blocking until one is ready"""
+        try:
+            message = self._ready.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("No result is ready") from None
+        kind, key = message[:2]
+        if kind == 'error':
+            return Result(self, key, error=message[2])
+        if kind == 'inline':
+            return Result(self, key, view=message[2])
+        slot, length = message[2:]
+        start = slot * self.slot_size
+        return Result(self, key, view=self._shm.buf[start:start + length], slot=slot)
+
+    def close(self):
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
@@ -0,0 +1,88 @@
+import struct
+
+
+# Status bytes for the channel 0 messages our generators emit
+STATUS_BYTES = {'note_on': 0x90, 'note_off': 0x80}
+
+END_OF_TRACK = b'\x00\xff\x2f\x00'
+
+# Header chunk followed by the track chunk's tag and length
+FILE_HEADER = struct.Struct('>4sLHHH4sL')
+
+
+def encode_vlq(value):
+    """Encode an integer as a MIDI variable-length quantity"""
+    data = [value & 0x7F]
+    value >>= 7
+    while value:
+        data.append((value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(reversed(data))
+
+
+def encode_events(events):
+    """Encode note events with running status
+
+    Returns the encoded bytes and the offset of every event's velocity byte.
+    """
+    data = bytearray()
+    velocity_offsets = []
+    running_status = None
+    for msg_type, note, velocity, time in events:
+        status = STATUS_BYTES[msg_type]
+        if not (0 <= note <= 127 and 0 <= velocity <= 127):
+            raise ValueError(f"data byte must be in range 0..127 (note {note}, velocity {velocity})")
+        data += encode_vlq(time)
+        if status != running_status:
+            data.append(status)
+            running_status = status
+        data.append(note)
+        data.append(velocity)
+        velocity_offsets.append(len(data) - 1)
+    return data, velocity_offsets
+
+
+def set_tempo(tempo):
+    """Encode a set_tempo meta message at delta time 0"""
+    return b'\x00\xff\x51\x03' + tempo.to_bytes(3, 'big')
+
+
+def program_change(program):
+    return bytes((0x00, 0xC0, program))
+
+
+def control_changes(controls):
+    """Encode (control, value) pairs at delta time 0 with running status"""
+    data = bytearray((0x00, 0xB0))
+    for i, (control, value) in enumerate(controls):
+        if i > 0:
+            data.append(0x00)
+        data += bytes((control, value))
+    return bytes(data)
+
+
+def file_bytes(track_data, ticks_per_beat, midi_type=0):
+    """Build a single-track standard MIDI file from raw track bytes"""
+    return b''.join([
+        b'MThd', struct.pack('>LHHH', 6, midi_type, 1, ticks_per_beat),
+        b'MTrk', struct.pack('>L', len(track_data) + len(END_OF_TRACK)),
+        track_data, END_OF_TRACK
+    ])
+
+
+def write_into(buffer, track_data, ticks_per_beat, midi_type=0):
+    """Write a single-track standard MIDI file into a writable buffer, returning its length"""
+    end = FILE_HEADER.size + len(track_data)
+    if end + len(END_OF_TRACK) > len(buffer):
+        raise ValueError("Buffer is too small for the MIDI file")
+    FILE_HEADER.pack_into(buffer, 0, b'MThd', 6, midi_type, 1, ticks_per_beat,
+                          b'MTrk', len(track_data) + len(END_OF_TRACK))
+    buffer[FILE_HEADER.size:end] = track_data
+    buffer[end:end + len(END_OF_TRACK)] = END_OF_TRACK
+    return end + len(END_OF_TRACK)
+
+
+def write_file(output_file, track_data, ticks_per_beat, midi_type=0):
+    """Write a single-track standard MIDI file from raw track bytes"""
+    with open(output_file, 'wb') as f:
+        f.write(file_bytes(track_data, ticks_per_beat, midi_type))
@@ -0,0 +1,201 @@
+import mmap
+import os
+import struct
+import numpy as np
+
+
+class TrackData:
+    """Header settings and note events decoded from a single-track MIDI file
+
+    Note events are (delta, status, note, velocity) arrays like the ones the
+    generators produce. Ticks spent on header events are folded into the
+    first note's delta and length is the total track length in ticks.
+    """
+
+    def __init__(self, midi_type, ticks_per_beat, tempo, program, controls,
+                 delta, status, note, velocity, length):
+        self.midi_type = midi_type
+        self.ticks_per_beat = ticks_per_beat
+        self.tempo = tempo
+        self.program = program
+        self.controls = controls
+        self.delta = delta
+        self.status = status
+        self.note = note
+        self.velocity = velocity
+        self.length = length
+
+    @property
+    def events(self):
+        return self.delta, self.status, self.note, self.velocity
+
+
+def _read_vlq(data, pos):
+    value = 0
+    while True:
+        byte = int(data[pos])
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if byte < 0x80:
+            return value, pos
+
+
+def _read_header_events(data, pos, end):
+    """Walk the events before the first note one message at a time
+
+    Returns where the first note event starts (None if the track ends
+    first), the ticks before it and the tempo, program and controllers set
+    on the way.
+    """
+    ticks = 0
+    tempo = program = None
+    controls = {}
+    running_status = None
+    while pos < end:
+        event_start = pos
+        delta, pos = _read_vlq(data, pos)
+        if data[pos] >= 0x80:
+            status = int(data[pos])
+            pos += 1
+        else:
+            status = running_status
+        if status is None:
+            raise ValueError("Data byte without a status byte")
+
+        kind = status & 0xF0
+        if kind in (0x80, 0x90):
+            return event_start, ticks, tempo, program, controls
+        ticks += delta
+        if status == 0xFF:
+            meta_type = int(data[pos])
+            length, pos = _read_vlq(data, pos + 1)
+            if meta_type == 0x51:
+                tempo = int.from_bytes(bytes(data[pos:pos + 3]), 'big')
+            elif meta_type == 0x2F:
+                return None, ticks, tempo, program, controls
+            pos += length
+        elif status in (0xF0, 0xF7):
+            length, pos = _read_vlq(data, pos)
+            pos += length
+        else:
+            running_status = status
+            if kind == 0xC0:
+                program = int(data[pos])
+            elif kind == 0xB0:
+                controls[int(data[pos])] = int(data[pos + 1])
+            pos += 1 if kind in (0xC0, 0xD0) else 2
+    raise ValueError("Track has no end of track event")
+
+
+def _decode_note_events(body):
+    """Decode a run of note events ending with end of track in one pass
+
+    Inside our note body every event is a delta VLQ, an optional status byte
+    and two data bytes. Data bytes and the last VLQ byte are the only bytes
+    below 0x80, so every third low byte starts an event's tail and the
+    layout of the whole track follows from the byte values alone. The end of
+    track meta event (00 FF 2F 00) has the same shape and is decoded last.
+    """
+    low = np.flatnonzero(body < 0x80)
+    if len(low) % 3:
+        raise ValueError("Unsupported event in note data")
+    last_delta_byte, first_data, second_data = low[0::3], low[1::3], low[2::3]
+    count = len(last_delta_byte)
+    gap = first_data - last_delta_byte
+    if count == 0 or np.any(second_data != first_data + 1) or np.any(gap > 2):
+        raise ValueError("Unsupported event in note data")
+    has_status = gap == 2
+    if not has_status[0]:
+        raise ValueError("Note data starts without a status byte")
+
+    # Every other high byte continues the VLQ of the next event
+    continuation = body >= 0x80
+    continuation[last_delta_byte[has_status] + 1] = False
+    positions = np.flatnonzero(continuation)
+    owner = np.searchsorted(last_delta_byte, positions)
+    shift = last_delta_byte[owner] - positions
+    if np.any(shift > 3):
+        raise ValueError("Delta time longer than four bytes")
+    high_bits = (body[positions].astype(np.int64) & 0x7F) << (7 * shift)
+    delta = body[last_delta_byte].astype(np.int64)
+    delta += np.bincount(owner, weights=high_bits, minlength=count).astype(np.int64)
+
+    # Running status: events without a status byte reuse the last one
+    status_bytes = body[last_delta_byte + 1]
+    latest = np.maximum.accumulate(np.where(has_status, np.arange(count), 0))
+    status = status_bytes[latest]
+    note = body[first_data]
+    velocity = body[second_data]
+
+    if status[-1] != 0xFF or note[-1] != 0x2F or velocity[-1] != 0 or second_data[-1] != len(body) - 1:
+        raise ValueError("Note data does not end with end of track")
+    kinds = status[:-1] & 0xF0
+    if np.any((kinds != 0x80) & (kinds != 0x90)):
+        raise ValueError("Unsupported event in note data")
+    return delta, status, note, velocity
+
+
+def parse(data):
+    """Decode a MIDI file held in a uint8 array"""
+    try:
+        if bytes(data[:4]) != b'MThd':
+            raise ValueError("Not a MIDI file")
+        header_length, midi_type, tracks, ticks_per_beat = struct.unpack('>LHHH', bytes(data[4:14]))
+        if tracks != 1:
+            raise ValueError(f"Expected a single track, found {tracks}")
+        if ticks_per_beat & 0x8000:
+            raise ValueError("SMPTE time division is not supported")
+
+        pos = 8 + header_length
+        while bytes(data[pos:pos + 4]) != b'MTrk':
+            chunk_length, = struct.unpack('>L', bytes(data[pos + 4:pos + 8]))
+            pos += 8 + chunk_length
+        track_length, = struct.unpack('>L', bytes(data[pos + 4:pos + 8]))
+        start, end = pos + 8, pos + 8 + track_length
+        if end > len(data):
+            raise ValueError("Track chunk is truncated")
+
+        note_start, header_ticks, tempo, program, controls = _read_header_events(data, start, end)
+        if note_start is None:
+            empty = np.zeros(0, dtype=np.uint8)
+            return TrackData(midi_type, ticks_per_beat, tempo, program, controls,
+                             np.zeros(0, dtype=np.int64), empty, empty, empty, header_ticks)
+
+        delta, status, note, velocity = _decode_note_events(data[note_start:end])
+    except (IndexError, struct.error):
+        raise ValueError("MIDI file is truncated") from None
+
+    length = header_ticks + int(delta.sum())
+    delta = delta[:-1]
+    if len(delta):
+        delta[0] += header_ticks
+    return TrackData(midi_type, ticks_per_beat, tempo, program, controls,
+                     delta, status[:-1], note[:-1], velocity[:-1], length)
+
+
+def find_files(paths):
+    """Expand files and directories into the MIDI files they contain"""
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, names in os.walk(path):
+                for name in sorted(names):
+                    if name.lower().endswith(('.mid', '.midi')):
+                        yield os.path.join(directory, name)
+        else:
+            yield path
+
+
+def read_file(path):
+    """Decode a MIDI file through a read-only memory map"""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError("Empty file")
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        return parse(np.frombuffer(mapped, dtype=np.uint8))
+    finally:
+        try:
+            mapped.close()
+        except BufferError:
+            # A failed parse can still reference the map; it closes once collected
+            pass
@@ -1,6 +1,9 @@
 // MIDI.js library for client-side MIDI generation
 class MIDIGenerator {
     constructor() {
+        this.output = null;
+        // Object URL of the file the download link currently points at
+        this.downloadUrl = null;
         this.initializeMIDI();
     }
 
@@ -8,6 +11,8 @@ class MIDIGenerator {
         if (navigator.requestMIDIAccess) {
             try {
                 this.midiAccess = await navigator.requestMIDIAccess();
+                // Play through the first available output port
+                this.output = this.midiAccess.outputs.values().next().value || null;
                 console.log('MIDI Access initialized');
             } catch (err) {
                 console.error('Error initializing MIDI:', err);
@@ -16,54 +21,191 @@ class MIDIGenerator {
     }
 
     generateMelody(params) {
-        // Create MIDI file data
-        const midiData = this.createMIDIFile(params);
-        
-        // Create download
-        this.createDownload(midiData, this.generateMelodyFilename(params));
+        const filename = this.generateMelodyFilename(params);
+        if (!this.output) {
+            // Nothing to play live, so fetch the packed events in one go
+            return this.fetchGeneration('/generate_melody', params, filename);
+        }
+        return this.streamGeneration('/stream_melody', params, filename);
     }
 
     generateChordProgression(params) {
-        // Create MIDI file data
-        const midiData = this.createMIDIFile(params);
-        
-        // Create download
-        this.createDownload(midiData, this.generateChordFilename(params));
+        const filename = this.generateChordFilename(params);
+        if (!this.output) {
+            return this.fetchGeneration('/generate_chord_progression', params, filename);
+        }
+        return this.streamGeneration('/stream_chord_progression', params, filename);
+    }
+
+    async fetchGeneration(url, params, filename) {
+        // Ask for the compact binary event export and render the MIDI file locally
+        const response = await fetch(url, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ ...params, format: 'binary' })
+        });
+        if (!response.ok) {
+            const error = await response.json();
+            throw new Error(error.message);
+        }
+
+        const { meta, events } = this.decodeEvents(await response.arrayBuffer());
+        const midiData = this.createMIDIFile(events, meta);
+        this.createDownload(midiData, filename);
+        return midiData;
+    }
+
+    decodeEvents(buffer) {
+        // Layout matches event_export.py: header, then delta/status/note/velocity columns
+        const view = new DataView(buffer);
+        const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+        if (magic !== 'MGEV') {
+            throw new Error('Unexpected event payload');
+        }
+        const meta = { ticks_per_beat: view.getUint16(5, true), bpm: view.getUint16(7, true) };
+        const count = view.getUint32(9, true);
+        const headerSize = 13;
+        const columns = new Uint8Array(buffer, headerSize + count * 4, count * 3);
+
+        const events = new Array(count);
+        for (let i = 0; i < count; i++) {
+            const delta = view.getUint32(headerSize + i * 4, true);
+            const type = columns[i] === 0x90 ? 'note_on' : 'note_off';
+            events[i] = [type, columns[count + i], columns[2 * count + i], delta];
+        }
+        return { meta, events };
     }
 
-    createMIDIFile(params) {
-        // This is a simplified version - you'll need to implement the actual MIDI generation logic
-        // For now, we'll create a simple MIDI file with a single note
-        const midiData = new Uint8Array([
+    async streamGeneration(url, params, filename) {
+        // Receive note events bar by bar and start playback as soon as the first bar arrives
+        const response = await fetch(url, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(params)
+        });
+        if (!response.ok) {
+            const error = await response.json();
+            throw new Error(error.message);
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        const events = [];
+        let meta = { ticks_per_beat: 480, bpm: 120 };
+        let playhead = null;
+        let buffer = '';
+
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            // Server-sent event frames are separated by a blank line
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const frame = this.parseEvent(buffer.slice(0, boundary));
+                buffer = buffer.slice(boundary + 2);
+
+                if (frame.event === 'meta') {
+                    meta = frame.data;
+                } else if (frame.event === 'bar') {
+                    events.push(...frame.data.events);
+                    playhead = this.scheduleEvents(frame.data.events, meta, playhead);
+                } else if (frame.event === 'error') {
+                    throw new Error(frame.data.message);
+                }
+            }
+        }
+
+        const midiData = this.createMIDIFile(events, meta);
+        this.createDownload(midiData, filename);
+        return midiData;
+    }
+
+    parseEvent(frame) {
+        const result = { event: 'message', data: null };
+        for (const line of frame.split('\n')) {
+            if (line.startsWith('event: ')) {
+                result.event = line.slice(7);
+            } else if (line.startsWith('data: ')) {
+                result.data = JSON.parse(line.slice(6));
+            }
+        }
+        return result;
+    }
+
+    scheduleEvents(events, meta, playhead) {
+        // Queue events on the Web MIDI output, continuing from where the previous bar ended
+        if (!this.output) return playhead;
+        const msPerTick = 60000 / (meta.bpm * meta.ticks_per_beat);
+        let when = playhead === null ? performance.now() : playhead;
+        for (const [type, note, velocity, time] of events) {
+            when += time * msPerTick;
+            const status = type === 'note_on' ? 0x90 : 0x80;
+            this.output.send([status, note, velocity], when);
+        }
+        return when;
+    }
+
+    writeVarLen(bytes, value) {
+        // MIDI variable-length quantity: 7 bits per byte, high bit marks continuation
+        const stack = [value & 0x7F];
+        value >>= 7;
+        while (value > 0) {
+            stack.push((value & 0x7F) | 0x80);
+            value >>= 7;
+        }
+        while (stack.length) bytes.push(stack.pop());
+    }
+
+    createMIDIFile(events, meta) {
+        // Build a type 0 standard MIDI file from (type, note, velocity, time) events
+        const track = [];
+        const tempo = Math.round(60000000 / meta.bpm);
+        track.push(0x00, 0xFF, 0x51, 0x03, (tempo >> 16) & 0xFF, (tempo >> 8) & 0xFF, tempo & 0xFF);
+        track.push(0x00, 0xC0, 0x00); // Program change
+        for (const [type, note, velocity, time] of events) {
+            this.writeVarLen(track, time);
+            track.push(type === 'note_on' ? 0x90 : 0x80, note, velocity);
+        }
+        track.push(0x00, 0xFF, 0x2F, 0x00); // End of track
+
+        const header = [
             0x4D, 0x54, 0x68, 0x64, // MThd
             0x00, 0x00, 0x00, 0x06, // Header size
             0x00, 0x00, // Format type
             0x00, 0x01, // Number of tracks
-            0x00, 0x60, // Time division
+            (meta.ticks_per_beat >> 8) & 0xFF, meta.ticks_per_beat & 0xFF, // Time division
             0x4D, 0x54, 0x72, 0x6B, // MTrk
-            0x00, 0x00, 0x00, 0x0B, // Chunk size
-            0x00, 0x90, // Note on
-            0x3C, // Note number (middle C)
-            0x40, // Velocity
-            0x83, 0x00, // Note off (after delay)
-            0x3C, // Note number
-            0x00, // Velocity
-            0x00  // End of track
-        ]);
+            (track.length >> 24) & 0xFF, (track.length >> 16) & 0xFF,
+            (track.length >> 8) & 0xFF, track.length & 0xFF // Chunk size
+        ];
 
-        return midiData;
+        return new Uint8Array(header.concat(track));
     }
 
     createDownload(midiData, filename) {
         const blob = new Blob([midiData], { type: 'audio/midi' });
         const url = window.URL.createObjectURL(blob);
-        const downloadLink = document.createElement('a');
+        const downloadLink = document.getElementById('download-link');
+        if (!downloadLink) {
+            // No link on the page to hold the file, so download it right away
+            const tempLink = document.createElement('a');
+            tempLink.href = url;
+            tempLink.download = filename;
+            document.body.appendChild(tempLink);
+            tempLink.click();
+            document.body.removeChild(tempLink);
+            window.URL.revokeObjectURL(url);
+            return;
+        }
+        // Free the previous file before the link points at the new one
+        if (this.downloadUrl) {
+            window.URL.revokeObjectURL(this.downloadUrl);
+        }
+        this.downloadUrl = url;
         downloadLink.href = url;
         downloadLink.download = filename;
-        document.body.appendChild(downloadLink);
-        downloadLink.click();
-        document.body.removeChild(downloadLink);
-        window.URL.revokeObjectURL(url);
     }
 
     generateMelodyFilename(params) {
@@ -83,17 +225,17 @@ const midiGenerator = new MIDIGenerator();
 // Form handling
 document.addEventListener('DOMContentLoaded', function() {
     // Melody form submission
-    document.getElementById('melody-form').addEventListener('submit', function(e) {
+    document.getElementById('melody-form').addEventListener('submit', async function(e) {
         e.preventDefault();
         const formData = new FormData(this);
         const params = Object.fromEntries(formData.entries());
-        
+
         // Add checkbox values
         params.use_swing = document.getElementById('use_swing').checked;
         params.use_humanization = document.getElementById('use_humanization').checked;
 
         try {
-            midiGenerator.generateMelody(params);
+            await midiGenerator.generateMelody(params);
             showSuccess();
         } catch (error) {
             showError(error.message);
@@ -101,13 +243,13 @@ document.addEventListener('DOMContentLoaded', function() {
     });
 
     // Chord form submission
-    document.getElementById('chord-form').addEventListener('submit', function(e) {
+    document.getElementById('chord-form').addEventListener('submit', async function(e) {
         e.preventDefault();
         const formData = new FormData(this);
         const params = Object.fromEntries(formData.entries());
 
         try {
-            midiGenerator.generateChordProgression(params);
+            await midiGenerator.generateChordProgression(params);
             showSuccess();
         } catch (error) {
             showError(error.message);
@@ -125,4 +267,4 @@ document.addEventListener('DOMContentLoaded', function() {
         document.getElementById('error-section').style.display = 'block';
         document.getElementById('result-section').style.display = 'none';
     }
-}); 
\ No newline at end of file
+});
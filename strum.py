@@ -0,0 +1,124 @@
+from itertools import chain
+import numpy as np
+
+
+NOTE_ON = 0x90
+NOTE_OFF = 0x80
+
+
+class StrumPattern:
+    """Note order and tick spacing of a strum for the note-ons and note-offs of a chord"""
+
+    __slots__ = ('reverse_on', 'speed_on', 'reverse_off', 'speed_off')
+
+    def __init__(self, reverse_on, speed_on, reverse_off, speed_off):
+        self.reverse_on = reverse_on
+        self.speed_on = speed_on
+        self.reverse_off = reverse_off
+        self.speed_off = speed_off
+
+
+def compile_patterns(strum_patterns, speeds=None):
+    """Compile strum pattern definitions once, including alt_<down>_<up> combinations
+
+    speeds optionally overrides the tick spacing for each speed name
+    (slow, med, fast) used in the pattern names.
+    """
+    def speed_of(name):
+        speed_name = name.rsplit('_', 1)[-1]
+        if speeds and speed_name in speeds:
+            return speeds[speed_name]
+        return strum_patterns[name]['speed']
+
+    compiled = {'none': StrumPattern(False, 0, False, 0)}
+    for name, pattern in strum_patterns.items():
+        direction = pattern['direction']
+        if direction == 'none':
+            continue
+        speed = speed_of(name)
+        if direction == 'alt':
+            # Strum down into the chord and back up out of it
+            compiled[name] = StrumPattern(False, speed, True, speed)
+        else:
+            reverse = direction == 'up'
+            compiled[name] = StrumPattern(reverse, speed, reverse, speed)
+
+    # Alternating strums can pair any down speed with any up speed
+    for down_name, down in list(compiled.items()):
+        if not down_name.startswith('down_'):
+            continue
+        for up_name, up in list(compiled.items()):
+            if not up_name.startswith('up_'):
+                continue
+            name = f"alt_{down_name[5:]}_{up_name[3:]}"
+            compiled[name] = StrumPattern(False, down.speed_on, True, up.speed_off)
+    return compiled
+
+
+def chord_progression_arrays(chords, velocities, ticks_per_beat, timing_mode, strum_in, strum_out,
+                             starts_track=True, ends_track=True):
+    """Note events for a run of chords as (delta, status, note, velocity) arrays
+
+    Each chord plays its note-ons then its note-offs. starts_track and
+    ends_track say whether the first and last chords are also the first and
+    last of the whole track, which changes their timing.
+    """
+    sizes = np.fromiter((len(chord) for chord in chords), dtype=np.int64, count=len(chords))
+    count = len(chords)
+    total = int(sizes.sum())
+    notes = np.fromiter(chain.from_iterable(chords), dtype=np.int64, count=total)
+    chord_velocities = np.fromiter(chain.from_iterable(velocities), dtype=np.int64, count=total)
+
+    # Position of every note within its chord
+    chord_start = np.zeros(count, dtype=np.int64)
+    np.cumsum(sizes[:-1], out=chord_start[1:])
+    chord_of_note = np.repeat(np.arange(count), sizes)
+    first_note = chord_start[chord_of_note]
+    size_of_note = sizes[chord_of_note]
+    index = np.arange(total) - first_note
+    reversed_index = first_note + size_of_note - 1 - index
+
+    is_last = np.zeros(count, dtype=bool)
+    if ends_track and count:
+        is_last[-1] = True
+
+    # Note-on timing: strummed notes follow the first note of each chord
+    on_delta = np.full(total, strum_in.speed_on, dtype=np.int64)
+    on_delta[chord_start] = ticks_per_beat if timing_mode == 1 else 0
+    if starts_track and count:
+        on_delta[0] = 0
+
+    # Note-off timing: the chord rings for what is left of the beat after strumming in
+    strum_duration = sizes * strum_in.speed_on
+    if timing_mode == 1:  # Regular mode
+        remaining = np.where(is_last, ticks_per_beat, np.maximum(0, ticks_per_beat - strum_duration))
+    else:  # Tight mode
+        remaining = np.maximum(1, ticks_per_beat - strum_duration)
+    off_delta = np.full(total, strum_out.speed_off, dtype=np.int64)
+    off_delta[chord_start] = remaining
+    if timing_mode == 2:
+        # Ensure at least 1 tick before the next chord
+        last_note = (chord_start + sizes - 1)[~is_last]
+        off_delta[last_note] = np.maximum(1, off_delta[last_note])
+
+    on_order = reversed_index if strum_in.reverse_on else np.arange(total)
+    off_order = reversed_index if strum_out.reverse_off else np.arange(total)
+
+    # Interleave: each chord's note-ons followed by its note-offs
+    on_position = 2 * first_note + index
+    off_position = on_position + size_of_note
+
+    delta = np.empty(2 * total, dtype=np.int64)
+    status = np.empty(2 * total, dtype=np.uint8)
+    note = np.empty(2 * total, dtype=np.int64)
+    velocity = np.zeros(2 * total, dtype=np.int64)
+
+    delta[on_position] = on_delta
+    status[on_position] = NOTE_ON
+    note[on_position] = notes[on_order]
+    velocity[on_position] = chord_velocities[on_order]
+
+    delta[off_position] = off_delta
+    status[off_position] = NOTE_OFF
+    note[off_position] = notes[off_order]
+    return delta, status, note, velocity
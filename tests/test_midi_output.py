@@ -0,0 +1,193 @@
+"""Files from the raw SMF writer compared with the same tracks written by mido"""
+import io
+import random
+import numpy as np
+import pytest
+from mido import Message, MetaMessage, MidiFile, MidiTrack, bpm2tempo
+import smf
+from main import MelodyGenerator
+
+
+@pytest.fixture(scope='module')
+def generator():
+    return MelodyGenerator()
+
+
+def mido_bytes(mid):
+    buffer = io.BytesIO()
+    mid.save(file=buffer)
+    return buffer.getvalue()
+
+
+def reference_melody(generator, root_note, mode, rhythm_pattern, bars, use_swing=False,
+                     swing_type='medium', use_humanization=False, humanization_amount=0.2):
+    """The melody as the mido writer built it before the raw SMF writer"""
+    mid = MidiFile()
+    track = MidiTrack()
+    mid.tracks.append(track)
+    track.append(Message('program_change', program=0, time=0))
+    track.append(Message('control_change', control=7, value=100, time=0))
+    track.append(Message('control_change', control=10, value=64, time=0))
+
+    root_midi = generator.NOTE_TO_MIDI[root_note]
+    scale_notes = [root_midi + interval for interval in generator.SCALE_MODES[mode]]
+    scale_notes.extend([note + 12 for note in scale_notes])
+    swing_amount = generator.SWING_AMOUNTS[swing_type] if use_swing else 0
+    for _ in range(bars):
+        for i, (duration, velocity) in enumerate(generator.RHYTHM_PATTERNS[rhythm_pattern]):
+            note = random.choice(scale_notes)
+            ticks = int(mid.ticks_per_beat * duration)
+            velocity_val = int(velocity * 64)
+            if use_swing:
+                ticks = generator.apply_swing(ticks, i % 2 == 1, swing_amount)
+            if use_humanization:
+                ticks = generator.apply_microshift(ticks, humanization_amount)
+                velocity_val = generator.apply_microshift(velocity_val, humanization_amount / 2)
+            track.append(Message('note_on', note=note, velocity=velocity_val, time=0))
+            track.append(Message('note_off', note=note, velocity=velocity_val, time=ticks))
+    return mido_bytes(mid)
+
+
+def reference_strum(generator, notes, velocities, strum_pattern, is_note_on, base_time):
+    """(note, velocity, delta) of a strummed chord as the mido writer spaced them"""
+    if strum_pattern == 'none':
+        return [(note, velocity, base_time if i == 0 else 0)
+                for i, (note, velocity) in enumerate(zip(notes, velocities))]
+    if strum_pattern.startswith('alt_'):
+        _, down_speed, up_speed = strum_pattern.split('_')
+        name = f"down_{down_speed}" if is_note_on else f"up_{up_speed}"
+    else:
+        name = strum_pattern
+    direction = generator.STRUM_PATTERNS[name]['direction']
+    speed = generator.STRUM_PATTERNS[name]['speed']
+    pairs = list(zip(notes, velocities))
+    if direction == 'up':
+        pairs.reverse()
+    return [(note, velocity, base_time if i == 0 else speed) for i, (note, velocity) in enumerate(pairs)]
+
+
+def reference_chords(generator, root_note, progression_type, bpm, total_bars, octave_choice,
+                     timing_mode, chord_type, inversion, strum_in, strum_out):
+    """The chord progression as the mido writer built it before the strum engine"""
+    progression = generator.parse_progression(progression_type)
+    repetitions = max(1, total_bars // len(progression))
+
+    mid = MidiFile(type=0)
+    track = MidiTrack()
+    mid.tracks.append(track)
+    track.append(MetaMessage('set_tempo', tempo=bpm2tempo(bpm), time=0))
+    track.append(Message('program_change', program=0, time=0))
+    for control, value in ((7, 100), (10, 64), (91, 0), (93, 0)):
+        track.append(Message('control_change', control=control, value=value, time=0))
+
+    root_midi = generator.NOTE_TO_MIDI[root_note] + (octave_choice + 1) * 12 - 36
+    qualities = generator.CHORD_QUALITIES[generator.QUALITY_MAP[chord_type]]
+    # Time the note-ons take to strum, per note
+    if strum_in == 'none':
+        strum_speed = 0
+    elif strum_in.startswith('alt_'):
+        strum_speed = generator.STRUM_PATTERNS[f"down_{strum_in.split('_')[1]}"]['speed']
+    else:
+        strum_speed = generator.STRUM_PATTERNS[strum_in]['speed']
+
+    for rep in range(repetitions):
+        for i, chord_root in enumerate(progression):
+            notes = [root_midi + chord_root + interval
+                     for interval in generator.CHORD_TYPES[qualities[chord_root]]]
+            if inversion:
+                rotate = random.randint(0, min(3, len(notes) - 1)) if inversion == 4 else inversion
+                rotate = min(rotate, len(notes) - 1)
+                notes = notes[rotate:] + [n + 12 for n in notes[:rotate]]
+            base_velocity = random.randint(64, 100)
+            velocities = [max(40, base_velocity + random.randint(-5, 5)) for _ in notes]
+            is_first = i == 0 and rep == 0
+            is_last = rep == repetitions - 1 and i == len(progression) - 1
+
+            for j, (note, velocity, time) in enumerate(
+                    reference_strum(generator, notes, velocities, strum_in, True, 0)):
+                if j == 0 and timing_mode == 1:
+                    time = 0 if is_first else mid.ticks_per_beat
+                elif j == 0:
+                    time = 0 if is_first else time
+                track.append(Message('note_on', note=note, velocity=velocity, time=time))
+
+            strum_duration = len(notes) * strum_speed
+            if timing_mode == 1:
+                remaining = mid.ticks_per_beat if is_last else mid.ticks_per_beat - strum_duration
+            else:
+                remaining = max(1, mid.ticks_per_beat - strum_duration)
+            strum_off = reference_strum(generator, notes, velocities, strum_out, False, remaining)
+            for j, (note, _, time) in enumerate(strum_off):
+                if timing_mode == 2 and j == len(strum_off) - 1 and not is_last:
+                    time = max(1, time)
+                track.append(Message('note_off', note=note, velocity=0, time=time))
+    return mido_bytes(mid)
+
+
+def seed(value):
+    # Humanization draws from numpy, everything else from random
+    random.seed(value)
+    np.random.seed(value)
+
+
+def test_encoder_matches_mido():
+    # Long gaps need multi-byte delta times and repeated kinds use running status
+    rng = random.Random(3)
+    events = []
+    for _ in range(200):
+        msg_type = rng.choice(['note_on', 'note_off'])
+        time = rng.choice([0, 5, 127, 128, 480, 16383, 16384, 2 ** 21 - 1, 2 ** 21, 2 ** 28 - 1])
+        events.append((msg_type, rng.randrange(128), rng.randrange(128), time))
+
+    mid = MidiFile(type=0)
+    track = MidiTrack()
+    mid.tracks.append(track)
+    for msg_type, note, velocity, time in events:
+        track.append(Message(msg_type, note=note, velocity=velocity, time=time))
+
+    data, _ = smf.encode_events(events)
+    assert smf.file_bytes(bytes(data), mid.ticks_per_beat, 0) == mido_bytes(mid)
+
+
+def test_encoder_rejects_out_of_range_data_bytes():
+    with pytest.raises(ValueError):
+        smf.encode_events([('note_on', 128, 64, 0)])
+    with pytest.raises(ValueError):
+        smf.encode_events([('note_on', 60, 128, 0)])
+
+
+@pytest.mark.parametrize('rhythm_pattern, use_swing, swing_type, use_humanization', [
+    ('basic', False, 'medium', False),
+    ('waltz', False, 'medium', False),
+    ('swing_eighth', True, 'heavy', False),
+    ('basic', True, 'light', True),
+])
+def test_melody_matches_mido(generator, rhythm_pattern, use_swing, swing_type, use_humanization):
+    for value in range(3):
+        seed(value)
+        generation = generator.build_melody('D', 'dorian', rhythm_pattern, 120, 4, use_swing,
+                                            swing_type, use_humanization, 0.2)
+        seed(value)
+        expected = reference_melody(generator, 'D', 'dorian', rhythm_pattern, 4, use_swing,
+                                    swing_type, use_humanization, 0.2)
+        assert generation.to_bytes() == expected
+
+
+@pytest.mark.parametrize('strum_in, strum_out', [
+    ('none', 'none'), ('down_med', 'none'), ('up_slow', 'up_fast'), ('alt_fast_slow', 'alt_slow_med'),
+    ('none', 'down_slow'),
+])
+@pytest.mark.parametrize('timing_mode', [1, 2])
+@pytest.mark.parametrize('inversion', [0, 1, 3, 4])
+@pytest.mark.parametrize('chord_type', [1, 5])
+def test_chord_progression_matches_mido(generator, strum_in, strum_out, timing_mode, inversion,
+                                        chord_type):
+    for progression_type, total_bars in (('jazz', 8), ('0-3-4-6-2', 5)):
+        seed(7)
+        generation = generator.build_chord_progression('E', progression_type, 96, total_bars, 2,
+                                                       timing_mode, chord_type, inversion,
+                                                       strum_in, strum_out)
+        seed(7)
+        expected = reference_chords(generator, 'E', progression_type, 96, total_bars, 2,
+                                    timing_mode, chord_type, inversion, strum_in, strum_out)
+        assert generation.to_bytes() == expected
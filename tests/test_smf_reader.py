@@ -0,0 +1,138 @@
+"""smf_reader.parse compared with mido reading the same files"""
+import io
+import random
+import numpy as np
+import pytest
+from mido import Message, MetaMessage, MidiFile, MidiTrack
+import smf
+import smf_reader
+from main import MelodyGenerator
+
+
+def mido_file(messages, midi_type=0, tracks=1):
+    mid = MidiFile(type=midi_type)
+    for _ in range(tracks):
+        track = MidiTrack()
+        track.extend(messages)
+        mid.tracks.append(track)
+    buffer = io.BytesIO()
+    mid.save(file=buffer)
+    return buffer.getvalue()
+
+
+def parse(data):
+    return smf_reader.parse(np.frombuffer(data, dtype=np.uint8))
+
+
+def expected_notes(data):
+    """Note events as mido reads them, with earlier ticks folded into the next note"""
+    delta, status, note, velocity = [], [], [], []
+    pending = length = 0
+    for message in MidiFile(file=io.BytesIO(data)).tracks[0]:
+        length += message.time
+        pending += message.time
+        if message.type in ('note_on', 'note_off'):
+            delta.append(pending)
+            status.append((0x90 if message.type == 'note_on' else 0x80) | message.channel)
+            note.append(message.note)
+            velocity.append(message.velocity)
+            pending = 0
+    return delta, status, note, velocity, length
+
+
+def assert_matches_mido(data):
+    track = parse(data)
+    delta, status, note, velocity, length = expected_notes(data)
+    assert track.delta.tolist() == delta
+    assert track.status.tolist() == status
+    assert track.note.tolist() == note
+    assert track.velocity.tolist() == velocity
+    assert track.length == length
+    return track
+
+
+def test_round_trip_with_long_deltas_and_running_status():
+    # Repeated kinds are written with running status; deltas need up to four VLQ bytes
+    rng = random.Random(5)
+    messages = [MetaMessage('set_tempo', tempo=600000, time=0),
+                Message('program_change', program=5, time=0),
+                Message('control_change', control=7, value=90, time=0),
+                Message('control_change', control=10, value=30, time=200)]
+    for _ in range(300):
+        messages.append(Message(rng.choice(['note_on', 'note_off']), note=rng.randrange(128),
+                                velocity=rng.randrange(128),
+                                time=rng.choice([0, 1, 127, 128, 16383, 16384, 2 ** 21, 2 ** 28 - 1])))
+    data = mido_file(messages)
+    assert data.count(b'\x90') + data.count(b'\x80') < 300  # running status is in use
+
+    track = assert_matches_mido(data)
+    assert track.tempo == 600000
+    assert track.program == 5
+    assert track.controls == {7: 90, 10: 30}
+
+
+@pytest.mark.parametrize('kind', ['melody', 'chords'])
+def test_round_trip_of_generated_files(kind):
+    generator = MelodyGenerator()
+    random.seed(11)
+    if kind == 'melody':
+        generation = generator.build_melody('F', 'blues', 'syncopated', 100, 4)
+    else:
+        generation = generator.build_chord_progression('A', 'jazz', 90, 8, 3, 2, 5, 5,
+                                                       'down_slow', 'up_fast')
+    track = assert_matches_mido(generation.to_bytes())
+    assert track.midi_type == generation.midi_type
+    assert track.ticks_per_beat == generation.ticks_per_beat
+
+
+def test_track_without_notes():
+    track = assert_matches_mido(mido_file([Message('program_change', program=1, time=0),
+                                           MetaMessage('marker', text='x', time=96)]))
+    assert len(track.note) == 0
+    assert track.length == 96
+
+
+def test_truncated_file():
+    data = mido_file([Message('note_on', note=60, velocity=90, time=0),
+                      Message('note_off', note=60, velocity=0, time=480)])
+    for cut in (10, 20, len(data) - 3):
+        with pytest.raises(ValueError):
+            parse(data[:cut])
+
+
+def test_non_note_event_in_body():
+    data = mido_file([Message('note_on', note=60, velocity=90, time=0),
+                      Message('control_change', control=64, value=127, time=10),
+                      Message('note_off', note=60, velocity=0, time=470)])
+    with pytest.raises(ValueError, match="Unsupported event"):
+        parse(data)
+
+    data = mido_file([Message('note_on', note=60, velocity=90, time=0),
+                      Message('pitchwheel', pitch=100, time=10),
+                      Message('note_off', note=60, velocity=0, time=470)])
+    with pytest.raises(ValueError, match="Unsupported event"):
+        parse(data)
+
+
+def test_rejects_other_layouts():
+    with pytest.raises(ValueError, match="Not a MIDI file"):
+        parse(b'RIFF' + bytes(40))
+    with pytest.raises(ValueError, match="single track"):
+        parse(mido_file([Message('note_on', note=60, velocity=90, time=0)], midi_type=1, tracks=2))
+    data = bytearray(smf.file_bytes(b'', 480, 0))
+    data[12:14] = b'\xe7\x28'  # SMPTE frames and ticks per frame
+    with pytest.raises(ValueError, match="SMPTE"):
+        parse(bytes(data))
+
+
+def test_read_file(tmp_path):
+    path = tmp_path / 'empty.mid'
+    path.write_bytes(b'')
+    with pytest.raises(ValueError, match="Empty file"):
+        smf_reader.read_file(str(path))
+
+    data = mido_file([Message('note_on', note=64, velocity=70, time=0),
+                      Message('note_off', note=64, velocity=0, time=240)])
+    path = tmp_path / 'one.mid'
+    path.write_bytes(data)
+    assert smf_reader.read_file(str(path)).note.tolist() == [64, 64]
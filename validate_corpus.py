@@ -0,0 +1,162 @@
+"""Validate and analyse a corpus of generated MIDI files
+
+Checks that note-ons and note-offs balance and that velocities are in
+range, then reports pitch and velocity statistics for the whole corpus.
+
+Given --bars, it also checks that melodies are as long as that many bars of
+their rhythm pattern. Chord progression lengths depend on the progression,
+strumming and timing mode rather than the bar count, so leave --bars out
+when checking them.
+
+    python validate_corpus.py static/generated --workers 8
+    python validate_corpus.py melodies/ --bars 4 --rhythm-pattern waltz
+"""
+import argparse
+import json
+import os
+import sys
+from functools import partial
+from multiprocessing import Pool
+import numpy as np
+import smf_reader
+
+# Only the generator's timing tables are needed: no audio, and no banner in the report
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+
+def unbalanced_notes(status, note, velocity):
+    """Return pitches with a note-off before their note-on and pitches left sounding"""
+    kind = status & 0xF0
+    is_on = (kind == 0x90) & (velocity > 0)
+    is_off = (kind == 0x80) | ((kind == 0x90) & (velocity == 0))
+    step = is_on.astype(np.int64) - is_off
+
+    # Count sounding notes per pitch in track order
+    order = np.lexsort((np.arange(len(note)), note))
+    pitches = note[order]
+    running = np.cumsum(step[order])
+    group_start = np.flatnonzero(np.r_[True, pitches[1:] != pitches[:-1]])
+    group_end = np.r_[group_start[1:], len(pitches)] - 1
+    base = running[group_start] - step[order][group_start]
+    level = running - np.repeat(base, group_end - group_start + 1)
+
+    early_off = np.unique(pitches[level < 0])
+    hanging = pitches[group_end][level[group_end] > 0]
+    return early_off.tolist(), hanging.tolist()
+
+
+def analyse_file(path, expected_ticks=None, tolerance=0.05, min_velocity=1, max_velocity=127):
+    """Check one file and collect its statistics"""
+    result = {'path': path, 'errors': []}
+    try:
+        track = smf_reader.read_file(path)
+    except (OSError, ValueError) as e:
+        result['errors'].append(str(e))
+        return result
+    errors = result['errors']
+
+    early_off, hanging = unbalanced_notes(track.status, track.note, track.velocity)
+    if early_off:
+        errors.append(f"note_off without note_on for pitches {early_off}")
+    if hanging:
+        errors.append(f"note_on without note_off for pitches {hanging}")
+
+    # A note-on with velocity 0 is a note-off, already checked for balance above
+    is_on = ((track.status & 0xF0) == 0x90) & (track.velocity > 0)
+    on_velocity = track.velocity[is_on]
+    out_of_range = (on_velocity < min_velocity) | (on_velocity > max_velocity)
+    if np.any(out_of_range):
+        errors.append(f"{int(out_of_range.sum())} note_on velocities outside {min_velocity}-{max_velocity}")
+
+    beats = track.length / track.ticks_per_beat
+    if expected_ticks is not None and abs(track.length - expected_ticks) > tolerance * expected_ticks:
+        errors.append(f"length is {track.length} ticks, expected {expected_ticks}")
+
+    result.update({
+        'notes': int(is_on.sum()),
+        'beats': beats,
+        'pitches': np.bincount(track.note[is_on], minlength=128),
+        'velocities': np.bincount(on_velocity, minlength=128)
+    })
+    return result
+
+
+def summarise(results, beats_per_bar):
+    """Combine per-file results into corpus statistics"""
+    valid = [r for r in results if 'notes' in r]
+    pitches = sum((r['pitches'] for r in valid), np.zeros(128, dtype=np.int64))
+    velocities = sum((r['velocities'] for r in valid), np.zeros(128, dtype=np.int64))
+    # Notes per bar of each file
+    density = np.array([r['notes'] * beats_per_bar / r['beats'] for r in valid if r['beats'] > 0])
+    used_velocities = np.flatnonzero(velocities)
+
+    return {
+        'files': len(results),
+        'failed': sum(1 for r in results if r['errors']),
+        'notes': int(pitches.sum()),
+        'pitch_histogram': {int(p): int(pitches[p]) for p in np.flatnonzero(pitches)},
+        'velocity_min': int(used_velocities[0]) if len(used_velocities) else None,
+        'velocity_max': int(used_velocities[-1]) if len(used_velocities) else None,
+        'velocity_mean': float(np.average(np.arange(128), weights=velocities)) if velocities.any() else None,
+        'notes_per_bar_mean': float(density.mean()) if len(density) else None,
+        'notes_per_bar_min': float(density.min()) if len(density) else None,
+        'notes_per_bar_max': float(density.max()) if len(density) else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate and analyse generated MIDI files")
+    parser.add_argument('paths', nargs='+', help="MIDI files or directories to scan")
+    parser.add_argument('--bars', type=int, help="check that melodies are this many bars long")
+    parser.add_argument('--rhythm-pattern', default='basic', help="rhythm pattern of the melodies")
+    parser.add_argument('--swing', metavar='SWING_TYPE', help="swing amount the melodies used")
+    parser.add_argument('--tolerance', type=float, default=0.05,
+                        help="allowed length difference as a fraction of the expected length; "
+                             "raise it for humanized melodies")
+    parser.add_argument('--beats-per-bar', type=float, default=4, help="bar length for note density")
+    parser.add_argument('--min-velocity', type=int, default=1)
+    parser.add_argument('--max-velocity', type=int, default=127)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    args = parser.parse_args()
+
+    expected_ticks = None
+    if args.bars is not None:
+        from main import MelodyGenerator
+        bar_ticks = MelodyGenerator().rhythm_ticks(args.rhythm_pattern, args.swing is not None,
+                                                   args.swing or 'medium')
+        expected_ticks = args.bars * sum(bar_ticks)
+
+    check = partial(analyse_file, expected_ticks=expected_ticks, tolerance=args.tolerance,
+                    min_velocity=args.min_velocity, max_velocity=args.max_velocity)
+    files = list(smf_reader.find_files(args.paths))
+    if args.workers > 1 and len(files) > 1:
+        with Pool(args.workers) as pool:
+            chunksize = max(1, min(256, len(files) // (args.workers * 4)))
+            results = list(pool.imap_unordered(check, files, chunksize=chunksize))
+    else:
+        results = [check(path) for path in files]
+
+    summary = summarise(results, args.beats_per_bar)
+    failures = sorted((r for r in results if r['errors']), key=lambda r: r['path'])
+    if args.json:
+        summary['failures'] = {r['path']: r['errors'] for r in failures}
+        print(json.dumps(summary, indent=2))
+    else:
+        for r in failures:
+            for error in r['errors']:
+                print(f"{r['path']}: {error}")
+        print(f"\n{summary['files']} files, {summary['failed']} failed, {summary['notes']} notes")
+        if summary['notes']:
+            print(f"Velocity: {summary['velocity_min']}-{summary['velocity_max']} "
+                  f"(mean {summary['velocity_mean']:.1f})")
+            print(f"Notes per bar: mean {summary['notes_per_bar_mean']:.2f}, "
+                  f"min {summary['notes_per_bar_min']:.2f}, max {summary['notes_per_bar_max']:.2f}")
+            top = sorted(summary['pitch_histogram'].items(), key=lambda item: -item[1])[:12]
+            print("Most used pitches: " + ", ".join(f"{pitch} ({count})" for pitch, count in top))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
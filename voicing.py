@@ -0,0 +1,131 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+def movement(a, b):
+    """Voice movement in semitones between two voicings of any size"""
+    distances = np.abs(np.subtract.outer(np.asarray(a), np.asarray(b)))
+    # Every note travels to its nearest note in the other chord, both ways,
+    # so chords with a different number of voices can still be compared
+    return distances.min(axis=1).sum() + distances.min(axis=0).sum()
+
+
+class VoiceLeader:
+    """Choose chord voicings that minimise total voice movement
+
+    Each chord can be played in any of its inversions, shifted by an octave
+    either way. The cheapest path through those states is found with a
+    Viterbi-style pass, so the cost is linear in progression length.
+
+    Movement doesn't change when both chords are transposed together, so
+    the movement matrix is computed once per pair of chord shapes and root
+    interval and shared by every key and octave; each chord then takes the
+    rows or columns of its candidates that fit the MIDI range. Caches keep
+    the most recent max_entries of each.
+    """
+
+    def __init__(self, octave_shifts=(-12, 0, 12), register_weight=0.5, max_entries=4096):
+        self.octave_shifts = octave_shifts
+        # Penalty per semitone of drift away from the root position register
+        self.register_weight = register_weight
+        self.max_entries = max_entries
+        self._candidates = OrderedDict()
+        self._transitions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cached(self, cache, key, compute):
+        with self._lock:
+            value = cache.get(key)
+            if value is not None:
+                cache.move_to_end(key)
+                return value
+
+        value = compute()
+        with self._lock:
+            cache[key] = value
+            if len(cache) > self.max_entries:
+                cache.popitem(last=False)
+        return value
+
+    def voicings(self, notes):
+        """Every inversion and octave shift of a root position chord, in or out of range"""
+        chord = list(notes)
+        voicings = []
+        for inversion in range(min(3, len(chord) - 1) + 1):
+            inverted = chord[inversion:] + [n + 12 for n in chord[:inversion]]
+            for shift in self.octave_shifts:
+                voicings.append(tuple(n + shift for n in inverted))
+        return voicings
+
+    def _candidate_set(self, notes):
+        """Playable voicings, their penalties and their indexes among all voicings"""
+        def compute():
+            chord = list(notes)
+            kept = [i for i, voicing in enumerate(self.voicings(chord))
+                    if min(voicing) >= 0 and max(voicing) <= 127]
+            if not kept:
+                raise ValueError(f"No playable voicing of chord {chord} within MIDI notes 0-127")
+            voicings = [self.voicings(chord)[i] for i in kept]
+            center = np.mean(chord)
+            penalties = np.array([abs(np.mean(v) - center) for v in voicings]) * self.register_weight
+            return voicings, penalties, np.array(kept)
+
+        return self._cached(self._candidates, tuple(notes), compute)
+
+    def candidates(self, notes):
+        """Return the candidate voicings of a root position chord and their penalties"""
+        return self._candidate_set(notes)[:2]
+
+    def transition(self, previous, current):
+        """Movement cost from every candidate of one chord to every candidate of the next"""
+        base = previous[0]
+        shape_a = tuple(n - base for n in previous)
+        shape_b = tuple(n - base for n in current)
+
+        def compute():
+            a = np.array(self.voicings(shape_a))
+            b = np.array(self.voicings(shape_b))
+            # distances[i, j, m, n]: note m of voicing i to note n of voicing j
+            distances = np.abs(a[:, None, :, None] - b[None, :, None, :])
+            return distances.min(axis=3).sum(axis=2) + distances.min(axis=2).sum(axis=2)
+
+        movement_matrix = self._cached(self._transitions, (shape_a, shape_b), compute)
+        rows = self._candidate_set(previous)[2]
+        columns = self._candidate_set(current)[2]
+        if len(rows) == movement_matrix.shape[0] and len(columns) == movement_matrix.shape[1]:
+            return movement_matrix
+        return movement_matrix[np.ix_(rows, columns)]
+
+    def solve(self, chords, before=None, after=None):
+        """Pick a voicing for each root position chord in order
+
+        before and after are fixed voicings around the sequence, used when
+        re-voicing part of an existing progression.
+        """
+        if not chords:
+            return []
+        candidates = [self.candidates(chord) for chord in chords]
+
+        cost = candidates[0][1].copy()
+        if before is not None:
+            cost += [movement(before, v) for v in candidates[0][0]]
+
+        back_pointers = []
+        for k in range(1, len(chords)):
+            total = cost[:, None] + self.transition(chords[k - 1], chords[k])
+            best = total.argmin(axis=0)
+            back_pointers.append(best)
+            cost = total[best, np.arange(total.shape[1])] + candidates[k][1]
+
+        if after is not None:
+            cost = cost + [movement(v, after) for v in candidates[-1][0]]
+
+        # Walk the back pointers from the cheapest final state
+        state = int(cost.argmin())
+        path = [state]
+        for best in reversed(back_pointers):
+            state = int(best[state])
+            path.append(state)
+        path.reverse()
+        return [list(candidates[k][0][state]) for k, state in enumerate(path)]